@@ -0,0 +1,218 @@
+"""Throughput benchmarks of frame_iter/batch_iter on synthetic videos
+
+The videos are generated with ffmpeg's lavfi sources (and cached in
+--video_dir), so results only depend on the machine and the ffmpeg build.
+Each case runs in a fresh process, so its peak RSS is its own.
+
+Usage:
+    python benchmarks/benchmark.py --output results.json
+    python benchmarks/benchmark.py --resolutions 360p --codecs h264 \\
+        --baseline results.json
+
+With --baseline the exit status is 1 if a case's fps dropped by more than
+--tolerance.
+"""
+import multiprocessing
+import subprocess
+import platform
+import resource
+import argparse
+import fnmatch
+import json
+import time
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import viderator
+
+SOURCES = {'testsrc': 'testsrc=size=%dx%d:rate=%s',
+           'mandelbrot': 'mandelbrot=size=%dx%d:rate=%s'}
+RESOLUTIONS = {'360p': (640, 360), '1080p': (1920, 1080), '4k': (3840, 2160)}
+# Encoder arguments and container of each codec
+CODECS = {'h264': (['-c:v', 'libx264', '-preset', 'veryfast'], '.mp4'),
+          'hevc': (['-c:v', 'libx265', '-preset', 'veryfast',
+                    '-x265-params', 'log-level=error'], '.mp4'),
+          'vp9': (['-c:v', 'libvpx-vp9', '-deadline', 'realtime',
+                   '-cpu-used', '8'], '.webm'),
+          'mpeg4': (['-c:v', 'mpeg4', '-q:v', '5'], '.avi')}
+# Iterator, options of each case
+CASES = {'all': ('frame_iter', {}),
+         'skip4': ('frame_iter', {'frame_skip': 4}),
+         'resize': ('frame_iter', {'size': (224, 224)}),
+         'crop': ('frame_iter', {'crop': (0, 0, 320, 240)}),
+         'gray': ('frame_iter', {'pix_fmt': 'gray'}),
+         'time_range': ('frame_iter', {'start_time': 2., 'end_time': 4.}),
+         'reuse_buffer': ('frame_iter', {'reuse_buffer': True}),
+         'prefetch': ('frame_iter', {'prefetch': 8}),
+         'batch': ('batch_iter', {'batch_size': 32}),
+         'batch_prefetch': ('batch_iter', {'batch_size': 32, 'prefetch': 2})}
+
+
+def video_path(video_dir, source, resolution, codec, duration=5.):
+    """Path of a synthetic video in video_dir"""
+    return os.path.join(video_dir, '%s_%s_%s_%gs%s' % (source, resolution, codec,
+                                                       duration, CODECS[codec][1]))
+
+
+def make_video(video_dir, source, resolution, codec, duration=5., fps='30'):
+    """Generate a synthetic video (if it doesn't exist yet)
+
+    Returns:
+        Path of the video
+
+    Raises:
+        IOError: If ffmpeg can't encode it (e.g., the encoder isn't in this build)
+    """
+    codec_args, ext = CODECS[codec]
+    path = video_path(video_dir, source, resolution, codec, duration)
+    if not os.path.exists(path):
+        if not os.path.isdir(video_dir):
+            os.makedirs(video_dir)
+        width, height = RESOLUTIONS[resolution]
+        # Written to a temp name, so an interrupted run isn't reused
+        tmp_path = path + '.tmp' + ext
+        try:
+            subprocess.check_call(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i',
+                                   SOURCES[source] % (width, height, fps), '-t', str(duration),
+                                   '-g', '60', '-pix_fmt', 'yuv420p'] + codec_args + [tmp_path])
+        except (OSError, subprocess.CalledProcessError), e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise IOError('Can\'t make %s: %s' % (os.path.basename(path), e))
+        os.rename(tmp_path, path)
+    return path
+
+
+def _run_case(path, case, results):
+    """Run one case in a worker process, put its measurements in results"""
+    try:
+        iterator, kw = CASES[case]
+        stats = viderator.FrameStats()
+        for item in getattr(viderator, iterator)(path, stats=stats, **kw):
+            pass
+        elapsed = stats.elapsed
+        # ru_maxrss is in KB on Linux (bytes on OS X)
+        scale = 1 if sys.platform == 'darwin' else 1024
+        results.put({'frames': stats.frames_yielded,
+                     'fps': stats.frames_yielded / elapsed,
+                     # Differs from fps with frame_skip
+                     'decoded_fps': stats.frames_decoded / elapsed,
+                     'bytes_per_sec': stats.bytes_read / elapsed,
+                     'startup_time': stats.startup_time,
+                     'read_time': stats.read_time,
+                     'elapsed': elapsed,
+                     'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+                     'ffmpeg_peak_rss': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale})
+    except Exception, e:
+        results.put({'error': '%s: %s' % (type(e).__name__, e)})
+
+
+def run_case(path, case, repeat=1):
+    """Run a case repeat times (each in a new process)
+
+    Returns:
+        Measurements of the run with the median fps
+    """
+    runs = []
+    for x in range(repeat):
+        results = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=_run_case, args=(path, case, results))
+        proc.start()
+        out = results.get()
+        proc.join()
+        if 'error' in out:
+            return out
+        runs.append(out)
+    runs.sort(key=lambda x: x['fps'])
+    return runs[len(runs) // 2]
+
+
+def _ffmpeg_version():
+    try:
+        out = subprocess.Popen(['ffmpeg', '-version'], stdout=subprocess.PIPE).communicate()[0]
+        return out.splitlines()[0]
+    except (OSError, IndexError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Print the fps of results relative to a baseline
+
+    Returns:
+        List of (video, case) whose fps dropped by more than tolerance
+    """
+    base = dict(((x['video'], x['case']), x) for x in baseline['results'] if 'fps' in x)
+    regressions = []
+    for x in results['results']:
+        old = base.get((x['video'], x['case']))
+        if old is None or 'fps' not in x:
+            continue
+        ratio = x['fps'] / old['fps']
+        flag = ''
+        if ratio < 1 - tolerance:
+            regressions.append((x['video'], x['case']))
+            flag = '  REGRESSION'
+        print '%-40s %-15s %8.1f -> %8.1f fps (%+.1f%%)%s' % (
+            x['video'], x['case'], old['fps'], x['fps'], 100 * (ratio - 1), flag)
+    return regressions
+
+
+def _select(names, patterns):
+    return [x for x in sorted(names) if any(fnmatch.fnmatch(x, p) for p in patterns)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark viderator on synthetic videos')
+    parser.add_argument('--video_dir', default='benchmark_videos',
+                        help='Where the generated videos are cached')
+    parser.add_argument('--sources', nargs='+', default=['*'], help='Patterns of %s' % sorted(SOURCES))
+    parser.add_argument('--resolutions', nargs='+', default=['*'], help='Patterns of %s' % sorted(RESOLUTIONS))
+    parser.add_argument('--codecs', nargs='+', default=['*'], help='Patterns of %s' % sorted(CODECS))
+    parser.add_argument('--cases', nargs='+', default=['*'], help='Patterns of %s' % sorted(CASES))
+    parser.add_argument('--duration', type=float, default=5., help='Length (sec) of the videos')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case (the median is kept)')
+    parser.add_argument('--output', help='JSON file to save the results in')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--tolerance', type=float, default=.1,
+                        help='Fps drop (fraction) reported as a regression')
+    args = parser.parse_args()
+    results = {'ffmpeg': _ffmpeg_version(), 'python': platform.python_version(),
+               'machine': platform.platform(), 'cpus': multiprocessing.cpu_count(),
+               'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': []}
+    for source in _select(SOURCES, args.sources):
+        for resolution in _select(RESOLUTIONS, args.resolutions):
+            for codec in _select(CODECS, args.codecs):
+                try:
+                    path = make_video(args.video_dir, source, resolution, codec, args.duration)
+                    error = None
+                except IOError, e:
+                    # Recorded for each case, the other videos still run
+                    path = video_path(args.video_dir, source, resolution, codec, args.duration)
+                    error = str(e)
+                video = os.path.basename(path)
+                for case in _select(CASES, args.cases):
+                    if error is None:
+                        out = run_case(path, case, args.repeat)
+                    else:
+                        out = {'error': error}
+                    out.update({'video': video, 'case': case})
+                    results['results'].append(out)
+                    if 'error' in out:
+                        print '%-40s %-15s %s' % (video, case, out['error'])
+                    else:
+                        print '%-40s %-15s %8.1f fps %7.1f MB/s %6.3f s startup %6.1f MB rss' % (
+                            video, case, out['fps'], out['bytes_per_sec'] / 2 ** 20,
+                            out['startup_time'], out['peak_rss'] / 2. ** 20)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=1, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+        if regressions:
+            print '%d regression(s)' % len(regressions)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -35,6 +35,29 @@ except ImportError:
 
 class Test(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        import subprocess
+        import tempfile
+        import os
+        # 40 sec at 29.97 fps, a GOP every 60 frames and a new picture every
+        # second (the rest are repeats), with the moov atom at the end
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.video = os.path.join(cls.tmpdir, 'video.mp4')
+        for codec_args in (['-c:v', 'libx264', '-preset', 'ultrafast',
+                            '-x264-params', 'scenecut=0:keyint=60:min-keyint=60'],
+                           ['-c:v', 'mpeg4', '-q:v', '5', '-sc_threshold', '1000000000']):
+            if not subprocess.call(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i',
+                                    'testsrc2=size=640x360:rate=1,hue=h=72*t',
+                                    '-r', '30000/1001', '-t', '40', '-g', '60',
+                                    '-pix_fmt', 'yuv420p'] + codec_args + [cls.video]):
+                break
+
+    @classmethod
+    def tearDownClass(cls):
+        import shutil
+        shutil.rmtree(cls.tmpdir)
+
     def setUp(self):
         pass
 
@@ -45,12 +68,106 @@ class Test(unittest.TestCase):
         import viderator
         self.assertRaises(IOError, viderator.frame_iter('sdklfjslkdfjsjdfkjskdfjsdjfkjskdfjskdfjksjfdj.IDONTEXIST.avi',).next)
 
+    def test_probe(self):
+        import viderator
+        import fractions
+        info = viderator.probe(self.video)
+        self.assertTrue(isinstance(info['fps'], fractions.Fraction))
+        frame = viderator.frame_iter(self.video).next()[2]
+        self.assertEqual(frame.shape[:2], (info['height'], info['width']))
+        self.assertTrue(info['duration'] > 0)
+        self.assertRaises(IOError, viderator.probe, 'sdklfjslkdfjsjdfkjskdfjsdjfkjskdfjskdfjksjfdj.IDONTEXIST.avi')
+
+    def test_catalog(self):
+        import viderator
+        import tempfile
+        import shutil
+        import os
+        tmpdir = tempfile.mkdtemp()
+        try:
+            db_path = os.path.join(tmpdir, 'catalog.db')
+            catalog = viderator.Catalog(db_path)
+            out = catalog.scan([self.video, 'sdklfjslkdfjsjdfkjskdfjsdjfkjskdfjskdfjksjfdj.IDONTEXIST.avi'])
+            self.assertEqual(out[os.path.abspath(self.video)], viderator.probe(self.video))
+            self.assertEqual(catalog.lookup(self.video), viderator.probe(self.video))
+            catalog.close()
+            self.assertEqual(viderator.Catalog(db_path).scan([self.video]).values(),
+                             [out[os.path.abspath(self.video)]])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_reader(self):
+        import viderator
+        import os
+        import numpy as np
+        frames = [frame for frame_num, frame_time, frame in viderator.frame_iter(self.video)]
+        index_path = os.path.join(self.tmpdir, 'reader.vidx')
+        reader = viderator.VideoReader(self.video, index_path=index_path)
+        self.assertTrue(os.path.exists(index_path))
+        self.assertEqual(len(reader), len(frames))
+        frame_nums = [1000, 0, 1, 59, 60, 61, 300, len(frames) - 1, 61]
+        for frame_num, frame in zip(frame_nums, reader.get_frames(frame_nums)):
+            self.assertTrue(np.all(frame == frames[frame_num]))
+        self.assertTrue(np.all(reader.get_frame(123) == frames[123]))
+        self.assertEqual(reader.frame_num_at(reader.frame_times[200]), 200)
+        self.assertRaises(IndexError, reader.get_frame, len(frames))
+
+    def test_reader_cache(self):
+        import viderator
+        import numpy as np
+        frames = [frame for frame_num, frame_time, frame in viderator.frame_iter(self.video, max_frames=200)]
+        reader = viderator.VideoReader(self.video, cache_bytes=100 * frames[0].nbytes)
+        self.assertTrue(np.all(reader.get_frame(70) == frames[70]))
+        self.assertEqual((reader.hits, reader.misses), (0, 1))
+        # The rest of the GOP was read ahead
+        for frame_num in range(60, 120):
+            self.assertTrue(np.all(reader.get_frame(frame_num) == frames[frame_num]))
+        self.assertEqual((reader.hits, reader.misses), (60, 1))
+        self.assertTrue(reader.cache_info()['bytes'] <= 100 * frames[0].nbytes)
+        self.assertFalse(reader.get_frame(70).flags.writeable)
+
+    def test_frame_cache(self):
+        import viderator
+        import tempfile
+        import shutil
+        import numpy as np
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cache = viderator.FrameCache(tmpdir)
+            kw = {'max_frames': 50, 'size': (64, 36)}
+            self.assertEqual(cache.get(self.video, **kw), None)
+            ref = list(viderator.frame_iter(self.video, **kw))
+            for x in range(2):
+                out = list(cache.frame_iter(self.video, **kw))
+                self.assertEqual([x[:2] for x in out], [x[:2] for x in ref])
+                self.assertTrue(all(np.all(x[2] == y[2]) for x, y in zip(out, ref)))
+            frame_nums, frame_times, frames = cache.get(self.video, **kw)
+            self.assertTrue(isinstance(frames, np.memmap))
+            self.assertEqual(frames.shape, (50, 36, 64, 3))
+            self.assertEqual(cache.get(self.video, max_frames=50), None)
+            # A new entry over the budget evicts the old one
+            cache.max_bytes = cache.size()
+            list(cache.frame_iter(self.video, max_frames=10, size=(64, 36)))
+            self.assertEqual(cache.get(self.video, **kw), None)
+            self.assertTrue(cache.get(self.video, max_frames=10, size=(64, 36)) is not None)
+            # yuv420p frames are cached raw and split again
+            kw = {'max_frames': 5, 'size': (64, 36), 'pix_fmt': 'yuv420p'}
+            ref = list(viderator.frame_iter(self.video, **kw))
+            for x in range(2):
+                out = list(cache.frame_iter(self.video, **kw))
+                for got, want in zip(out, ref):
+                    self.assertEqual(len(got[2]), 3)
+                    self.assertTrue(all(np.all(a == b) for a, b in zip(got[2], want[2])))
+            self.assertEqual(cache.get(self.video, **kw)[2].shape, (5, 54, 64))
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_basic(self):
         import viderator
         import time
         import numpy as np
         st = time.time()
-        for frame_num, frame_time, frame in viderator.frame_iter('HVC236624.mp4'):
+        for frame_num, frame_time, frame in viderator.frame_iter(self.video):
             self.assertTrue(isinstance(frame_num, int))
             self.assertTrue(isinstance(frame_time, float))
             self.assertTrue(isinstance(frame, np.ndarray))
@@ -64,7 +181,7 @@ class Test(unittest.TestCase):
         import time
         import numpy as np
         st = time.time()
-        for frame_num, frame_time, frame in viderator.frame_iter('HVC236624.mp4', frame_skip=2):
+        for frame_num, frame_time, frame in viderator.frame_iter(self.video, frame_skip=2):
             self.assertTrue(frame_num % 2 == 0)
             self.assertTrue(isinstance(frame_num, int))
             self.assertTrue(isinstance(frame_time, float))
@@ -74,6 +191,501 @@ class Test(unittest.TestCase):
         print(frame_num)
         print((time.time() - st) / float(frame_num))
 
+    def test_skip_matches_all(self):
+        import viderator
+        import numpy as np
+        frames = {}
+        for frame_num, frame_time, frame in viderator.frame_iter(self.video):
+            if frame_num > 100:
+                break
+            frames[frame_num] = frame_time, frame
+        for frame_num, frame_time, frame in viderator.frame_iter(self.video, frame_skip=7):
+            if frame_num > 100:
+                break
+            self.assertEqual(frame_time, frames[frame_num][0])
+            self.assertTrue(np.all(frame == frames[frame_num][1]))
+
+    def test_time_range(self):
+        import viderator
+        import numpy as np
+        frames = {}
+        for frame_num, frame_time, frame in viderator.frame_iter(self.video):
+            if frame_num > 200:
+                break
+            frames[frame_num] = frame_time, frame
+        start_time = frames[101][0]
+        end_time = frames[150][0]
+        out = list(viderator.frame_iter(self.video, start_time=start_time,
+                                        end_time=end_time))
+        self.assertEqual([x[0] for x in out], range(101, 150))
+        for frame_num, frame_time, frame in out:
+            self.assertEqual(frame_time, frames[frame_num][0])
+            self.assertTrue(np.all(frame == frames[frame_num][1]))
+        out = list(viderator.frame_iter(self.video, start_time=start_time,
+                                        frame_skip=2, max_frames=5))
+        self.assertEqual([x[0] for x in out], range(102, 112, 2))
+
+    def test_data_input(self):
+        import viderator
+        import subprocess
+        import io
+        import numpy as np
+        # mkv can be read from a pipe (the mp4's moov atom is at the end)
+        data = subprocess.Popen(['ffmpeg', '-v', 'error', '-i', self.video, '-an',
+                                 '-c', 'copy', '-f', 'matroska', '-'],
+                                stdout=subprocess.PIPE).communicate()[0]
+        kw = {'start_time': 2., 'max_frames': 30, 'size': (64, 36)}
+        ref = list(viderator.frame_iter(self.video, **kw))
+        self.assertEqual(viderator.probe(data)['width'], viderator.probe(self.video)['width'])
+        for source in [data, bytearray(data), memoryview(data), io.BytesIO(data)]:
+            out = list(viderator.frame_iter(source, **kw))
+            self.assertEqual([x[:2] for x in out], [x[:2] for x in ref])
+            self.assertTrue(all(np.all(x[2] == y[2]) for x, y in zip(out, ref)))
+        self.assertEqual(viderator.frame_iter(data).next()[0], 0)
+
+    def test_stats(self):
+        import viderator
+        import tempfile
+        import shutil
+        calls = []
+        stats = viderator.FrameStats(hook=calls.append, interval=0.)
+        frames = list(viderator.frame_iter(self.video, frame_skip=2, max_frames=40,
+                                           size=(64, 36), prefetch=4, stats=stats))
+        self.assertEqual(stats.frames_yielded, 40)
+        self.assertEqual(stats.frames_read, 40)
+        self.assertEqual(stats.frames_decoded, 80)
+        self.assertEqual(stats.bytes_read, 40 * frames[0][2].nbytes)
+        self.assertTrue(0 < stats.startup_time <= stats.elapsed)
+        self.assertTrue(stats.fps > 0 and stats.read_time > 0)
+        self.assertEqual(len(calls), 41)
+        stats = viderator.FrameStats()
+        for batch in viderator.batch_iter(self.video, batch_size=16, max_frames=40,
+                                          stats=stats):
+            pass
+        self.assertEqual(stats.to_dict()['frames_yielded'], 40)
+        # Frames ffmpeg drops are counted (up to the last frame read), the
+        # decoder only decodes the keyframes
+        for kw in [{'scene_threshold': .01}, {'sample_fps': 1}, {'sample_fps': 1, 'start_time': 10.},
+                   {'keyframes': True}]:
+            stats = viderator.FrameStats()
+            frames = list(viderator.frame_iter(self.video, end_time=20., size=(64, 36), stats=stats, **kw))
+            if 'keyframes' in kw:
+                self.assertEqual(stats.frames_decoded, len(frames))
+            else:
+                first = int(round(kw.get('start_time', 0) * 29.97))
+                self.assertTrue(frames[-1][0] - first < stats.frames_decoded <= frames[-1][0] - first + 2)
+            # The same counts from the pool's workers
+            decoded = stats.frames_decoded
+            list(viderator.pool_iter([self.video], end_time=20., size=(64, 36), stats=stats, **kw))
+            self.assertEqual(stats.frames_decoded, 2 * decoded)
+        # Every iterator takes one
+        for frames in [lambda stats: viderator.pool_iter([self.video] * 2, max_frames=20, stats=stats),
+                       lambda stats: viderator.segment_iter(self.video, num_segments=2,
+                                                            max_frames=40, stats=stats)]:
+            stats = viderator.FrameStats()
+            self.assertEqual(len(list(frames(stats))), 40)
+            self.assertEqual((stats.frames_yielded, stats.frames_read), (40, 40))
+            self.assertTrue(stats.bytes_read > 0 and stats.startup_time > 0)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cache = viderator.FrameCache(tmpdir)
+            for x in range(2):
+                stats = viderator.FrameStats()
+                list(cache.frame_iter(self.video, max_frames=10, stats=stats))
+            self.assertEqual(stats.frames_yielded, 0)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_threads(self):
+        import viderator
+        import tempfile
+        import shutil
+        import os
+        import numpy as np
+        ref = list(viderator.frame_iter(self.video, max_frames=20))
+        for kw in [{'threads': 2, 'thread_type': 'slice'}, {'threads': 1}]:
+            out = list(viderator.frame_iter(self.video, max_frames=20, **kw))
+            self.assertTrue(all(np.all(x[2] == y[2]) for x, y in zip(out, ref)))
+        tuned = viderator.tune_threads(concurrency=1, num_cpus=2, duration=.5)
+        self.assertTrue((tuned['threads'], tuned['thread_type']) in [(1, 'frame'), (2, 'frame'), (2, 'slice')])
+        self.assertEqual(len(tuned['times']), 3)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cache_path = os.path.join(tmpdir, 'threads.json')
+            threads, thread_type = viderator.decoder_threads(2, cache_path=cache_path)
+            self.assertTrue(os.path.exists(cache_path))
+            self.assertEqual(viderator.decoder_threads(2, cache_path=cache_path), (threads, thread_type))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_backends(self):
+        import viderator
+        import numpy as np
+        self.assertEqual(viderator.available_backends(frozen=True), ['ffmpeg'])
+        self.assertEqual(viderator.available_backends(), ['ffmpeg'])
+        kw = {'start_time': 1., 'max_frames': 30, 'frame_skip': 3}
+        ref = list(viderator.frame_iter(self.video, **kw))
+        out = list(viderator.frame_iter(self.video, backend='ffmpeg', **kw))
+        self.assertEqual([x[:2] for x in out], [x[:2] for x in ref])
+        self.assertTrue(all(np.all(x[2] == y[2]) for x, y in zip(out, ref)))
+        self.assertRaises(ValueError, viderator.frame_iter(self.video, backend='pyav').next)
+
+    def test_pix_fmt(self):
+        import viderator
+        import numpy as np
+        bgr = viderator.frame_iter(self.video).next()[2]
+        rgb = viderator.frame_iter(self.video, pix_fmt='rgb24').next()[2]
+        self.assertEqual(bgr.shape, rgb.shape)
+        self.assertTrue(bgr.flags['C_CONTIGUOUS'])
+        self.assertTrue(np.all(bgr == rgb[:, :, ::-1]))
+
+    def test_yuv420p(self):
+        import viderator
+        import numpy as np
+        gray = viderator.frame_iter(self.video, pix_fmt='gray').next()[2]
+        y, u, v = viderator.frame_iter(self.video, pix_fmt='yuv420p').next()[2]
+        self.assertEqual(y.shape, gray.shape)
+        self.assertEqual(u.shape, (gray.shape[0] // 2, gray.shape[1] // 2))
+        self.assertEqual(v.shape, u.shape)
+        # gray is full range, Y is limited (16-235)
+        self.assertTrue(np.abs((y - 16.) * 255 / 219 - gray).mean() < 1)
+        # Views of one contiguous buffer
+        self.assertTrue(y.base.flags['C_CONTIGUOUS'])
+        self.assertTrue(np.may_share_memory(y.base, u) and np.may_share_memory(y.base, v))
+        frames = viderator.batch_iter(self.video, batch_size=4, pix_fmt='yuv420p').next()[0]
+        self.assertTrue(np.all(viderator.yuv_planes(frames)[0][0] == y))
+        self.assertTrue(np.all(viderator.yuv_planes(frames)[2][0] == v))
+
+    def test_size_crop_gray(self):
+        import viderator
+        frame = viderator.frame_iter(self.video, size=(224, 160)).next()[2]
+        self.assertEqual(frame.shape, (160, 224, 3))
+        frame = viderator.frame_iter(self.video, pix_fmt='gray').next()[2]
+        self.assertEqual(frame.ndim, 2)
+        full = viderator.frame_iter(self.video).next()[2]
+        frame = viderator.frame_iter(self.video, crop=(10, 20, 100, 50)).next()[2]
+        self.assertEqual(frame.shape, (50, 100, 3))
+        self.assertTrue((frame == full[20:70, 10:110]).all())
+        frame = viderator.frame_iter(self.video, crop=(10, 20, 100, 50),
+                                     size=(32, 16), pix_fmt='gray').next()[2]
+        self.assertEqual(frame.shape, (16, 32))
+
+    def test_batch(self):
+        import viderator
+        import numpy as np
+        frames = list(viderator.frame_iter(self.video, frame_skip=3, max_frames=50))
+        batches = [(batch.copy(), frame_nums, frame_times)
+                   for batch, frame_nums, frame_times in
+                   viderator.batch_iter(self.video, batch_size=8, frame_skip=3, max_frames=50)]
+        self.assertEqual([len(x[0]) for x in batches], [8] * 6 + [2])
+        self.assertEqual(batches[0][0].shape[1:], frames[0][2].shape)
+        self.assertEqual(list(np.concatenate([x[1] for x in batches])), [x[0] for x in frames])
+        self.assertEqual(list(np.concatenate([x[2] for x in batches])), [x[1] for x in frames])
+        self.assertTrue(np.all(np.concatenate([x[0] for x in batches]) == np.array([x[2] for x in frames])))
+
+    def test_prefetch(self):
+        import viderator
+        import numpy as np
+        frames = list(viderator.frame_iter(self.video, max_frames=100))
+        out = []
+        for frame_num, frame_time, frame in viderator.frame_iter(self.video, max_frames=100,
+                                                                 prefetch=4, reuse_buffer=True):
+            expected = frames[len(out)]
+            out.append((frame_num, frame_time, np.all(frame == expected[2])))
+        self.assertEqual([x[:2] for x in out], [x[:2] for x in frames])
+        self.assertTrue(all(x[2] for x in out))
+        self.assertRaises(IOError, viderator.frame_iter('sdklfjslkdfjsjdfkjskdfjsdjfkjskdfjskdfjksjfdj.IDONTEXIST.avi',
+                                                        prefetch=2).next)
+
+    def test_pool(self):
+        import viderator
+        import numpy as np
+        frames = list(viderator.frame_iter(self.video, frame_skip=10))
+        file_names = [self.video] * 3
+        for ordered in [False, True]:
+            out = dict((x, []) for x in range(len(file_names)))
+            order = []
+            for video_id, frame_num, frame_time, frame in viderator.pool_iter(file_names, num_workers=2,
+                                                                               ordered=ordered, frame_skip=10):
+                expected = frames[len(out[video_id])]
+                out[video_id].append((frame_num, frame_time, np.all(frame == expected[2])))
+                order.append(video_id)
+            for video_out in out.values():
+                self.assertEqual([x[:2] for x in video_out], [x[:2] for x in frames])
+                self.assertTrue(all(x[2] for x in video_out))
+            if ordered:
+                self.assertEqual(order, sorted(order))
+        # Options the workers decode with, others are rejected up front
+        kw = {'keyframes': True, 'scene_threshold': .01, 'scene_method': 'ffmpeg', 'size': (64, 36)}
+        self.assertEqual([x[1] for x in viderator.pool_iter(file_names[:1], **kw)],
+                         [x[0] for x in viderator.frame_iter(self.video, **kw)])
+        self.assertRaises(ValueError, viderator.pool_iter, file_names, prefetch=2)
+        self.assertRaises(ValueError, viderator.pool_iter, file_names, scene_method='numpy')
+        self.assertRaises(ValueError, viderator.segment_iter(self.video, scene_threshold=.1).next)
+
+    def test_segment(self):
+        import viderator
+        import numpy as np
+        for kw in [{}, {'frame_skip': 7, 'start_time': 3.3, 'end_time': 20.},
+                   {'keyframes': True, 'start_time': 3.3}]:
+            frames = list(viderator.frame_iter(self.video, **kw))
+            out = [(frame_num, frame_time, frame.copy())
+                   for frame_num, frame_time, frame in viderator.segment_iter(self.video, num_segments=5,
+                                                                              num_workers=3, **kw)]
+            self.assertEqual([x[:2] for x in out], [x[:2] for x in frames])
+            self.assertTrue(all(np.all(x[2] == y[2]) for x, y in zip(out, frames)))
+        # Split into planes like frame_iter's
+        frames = list(viderator.frame_iter(self.video, pix_fmt='yuv420p', max_frames=90))
+        out = [(frame_num, frame_time, [x.copy() for x in frame])
+               for frame_num, frame_time, frame in viderator.segment_iter(
+                   self.video, num_segments=2, pix_fmt='yuv420p', max_frames=90)]
+        self.assertEqual([x[:2] for x in out], [x[:2] for x in frames])
+        for x, y in zip(out, frames):
+            self.assertTrue(all(np.all(a == b) for a, b in zip(x[2], y[2])))
+        # Each segment would keep its first frame
+        for kw in [{'sample_fps': 1}, {'scene_threshold': .1}]:
+            self.assertRaises(ValueError, viderator.segment_iter(self.video, **kw).next)
+
+    def test_reuse_buffer(self):
+        import viderator
+        frames = []
+        for frame_num, frame_time, frame in viderator.frame_iter(self.video, reuse_buffer=True):
+            frames.append(frame)
+            if frame_num >= 10:
+                break
+        self.assertTrue(all(frame is frames[0] for frame in frames))
+
+    def test_aframe_iter(self):
+        import viderator
+        import multiprocessing
+        import numpy as np
+        from viderator import threads
+        try:
+            import trollius
+            from trollius import From, Return
+        except ImportError:
+            self.skipTest('trollius is not installed')
+        kw = {'start_time': 5., 'max_frames': 20, 'size': (64, 36)}
+        ref = list(viderator.frame_iter(self.video, **kw))
+
+        @trollius.coroutine
+        def read_all(frames):
+            out = []
+            while True:
+                x = yield From(frames.next())
+                if x is None:
+                    raise Return(out)
+                out.append(x)
+        loop = trollius.get_event_loop()
+        outs = loop.run_until_complete(trollius.gather(
+            *[read_all(viderator.aframe_iter(self.video, **kw)) for x in range(3)]))
+        for out in outs:
+            self.assertEqual([x[:2] for x in out], [x[:2] for x in ref])
+            self.assertTrue(all(np.all(x[2] == y[2]) for x, y in zip(out, ref)))
+        stats = viderator.FrameStats()
+        loop.run_until_complete(read_all(viderator.aframe_iter(self.video, stats=stats, **kw)))
+        self.assertEqual((stats.frames_yielded, stats.frames_read), (20, 20))
+        out = loop.run_until_complete(read_all(viderator.aframe_iter(self.video, pix_fmt='yuv420p', **kw)))
+        ref_yuv = list(viderator.frame_iter(self.video, pix_fmt='yuv420p', **kw))
+        for x, y in zip(out, ref_yuv):
+            self.assertEqual([a.shape for a in x[2]], [(36, 64), (18, 32), (18, 32)])
+            self.assertTrue(all(np.all(a == b) for a, b in zip(x[2], y[2])))
+        # threads='auto' with a tuned setting in memory, so the test doesn't
+        # tune or write ~/.viderator_threads.json
+        key = (threads.CACHE_PATH, '%s|%d cpus|1 at once' % (
+            threads._ffmpeg_version(), multiprocessing.cpu_count()))
+        tuned = threads._tuned.get(key)
+        threads._tuned[key] = (2, 'slice')
+        try:
+            out = loop.run_until_complete(read_all(viderator.aframe_iter(self.video, threads='auto', **kw)))
+        finally:
+            if tuned is None:
+                del threads._tuned[key]
+            else:
+                threads._tuned[key] = tuned
+        self.assertTrue(all(np.all(x[2] == y[2]) for x, y in zip(out, ref)))
+        self.assertEqual(len(out), 20)
+        for drop_kw in [{'scene_threshold': .1}, {'keyframes': True}, {'sample_fps': 1}]:
+            self.assertRaises(ValueError, viderator.aframe_iter, self.video, **drop_kw)
+        # Cancelling a read kills ffmpeg
+        frames = viderator.aframe_iter(self.video)
+        loop.run_until_complete(frames.next())
+        task = trollius.Task(frames.next())
+        # Cancelled after the task starts waiting for the frame
+        loop.call_soon(task.cancel)
+        self.assertRaises(trollius.CancelledError, loop.run_until_complete, task)
+        self.assertTrue(loop.run_until_complete(frames._proc.wait()) != 0)
+        self.assertEqual(loop.run_until_complete(frames.next()), None)
+
+    def test_scene_threshold(self):
+        import viderator
+        import numpy as np
+        kw = {'size': (160, 90), 'end_time': 25.}
+        full = dict((x[0], x) for x in viderator.frame_iter(self.video, **kw))
+        for method, threshold in (('ffmpeg', .01), ('numpy', .05)):
+            out = list(viderator.frame_iter(self.video, scene_threshold=threshold,
+                                            scene_method=method, **kw))
+            self.assertEqual(out[0][0], 0)
+            self.assertTrue(1 < len(out) < len(full))
+            # Original numbers and times
+            for frame_num, frame_time, frame in out:
+                self.assertAlmostEqual(frame_time, full[frame_num][1])
+                self.assertTrue(np.all(frame == full[frame_num][2]))
+            out = list(viderator.frame_iter(self.video, scene_threshold=threshold,
+                                            scene_method=method, start_time=10.,
+                                            max_frames=3, **kw))
+            self.assertEqual(len(out), 3)
+            self.assertEqual(out[0][0], 300)
+            self.assertTrue(all(np.all(x[2] == full[x[0]][2]) for x in out))
+
+    def test_keyframes(self):
+        import viderator
+        import numpy as np
+        import subprocess
+        out = subprocess.Popen(['ffprobe', '-v', 'error', '-select_streams', 'v', '-show_frames',
+                                '-show_entries', 'frame=key_frame', self.video],
+                               stdout=subprocess.PIPE).communicate()[0]
+        key_frames = [x for x in out.splitlines() if x.startswith('key_frame=')]
+        key_nums = [n for n, x in enumerate(key_frames) if x == 'key_frame=1']
+        kw = {'size': (160, 90)}
+        full = dict((x[0], x) for x in viderator.frame_iter(self.video, **kw))
+        out = list(viderator.frame_iter(self.video, keyframes=True, **kw))
+        self.assertEqual([x[0] for x in out], key_nums)
+        for frame_num, frame_time, frame in out:
+            self.assertAlmostEqual(frame_time, full[frame_num][1])
+            self.assertTrue(np.all(frame == full[frame_num][2]))
+        out = list(viderator.frame_iter(self.video, keyframes=True, start_time=10.,
+                                        end_time=20., **kw))
+        self.assertEqual([x[0] for x in out], [x for x in key_nums if 300 <= x < 600])
+
+    def test_sample_fps(self):
+        import viderator
+        import subprocess
+        import tempfile
+        import shutil
+        import numpy as np
+        kw = {'size': (160, 90)}
+        full = dict((x[0], x) for x in viderator.frame_iter(self.video, end_time=20., **kw))
+        out = list(viderator.frame_iter(self.video, sample_fps=2, end_time=20., **kw))
+        self.assertEqual([x[0] for x in out], [int(np.ceil(x * 29.97 / 2)) for x in range(40)])
+        for frame_num, frame_time, frame in out:
+            self.assertAlmostEqual(frame_time, full[frame_num][1])
+            self.assertTrue(np.all(frame == full[frame_num][2]))
+        # Variable frame rate, 30 fps for 2 sec then 10 fps
+        tmpdir = tempfile.mkdtemp()
+        try:
+            # After a seek, the same frames as a full pass (on an integer
+            # frame rate the sample boundaries fall exactly on frames)
+            path = tmpdir + '/cfr.mp4'
+            subprocess.check_call(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i',
+                                   'testsrc=size=64x64:rate=30', '-t', '12', '-c:v', 'mpeg4',
+                                   '-g', '30', path])
+            full = [x[:2] for x in viderator.frame_iter(path, sample_fps=4)]
+            for start_time, end_time in [(1., None), (2.5, 9.), (3.3, None)]:
+                out = [x[:2] for x in viderator.frame_iter(path, sample_fps=4, start_time=start_time,
+                                                             end_time=end_time)]
+                self.assertEqual(out, [x for x in full if start_time <= x[1] < (end_time or 12)])
+            path = tmpdir + '/vfr.mp4'
+            subprocess.check_call(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i',
+                                   'testsrc=size=64x64:rate=30', '-t', '4', '-vf',
+                                   "setpts='if(lt(T,2),N/30,2+(N-60)/10)/TB'",
+                                   '-fps_mode', 'vfr', '-c:v', 'mpeg4', path])
+            times = [x / 30. for x in range(60)] + [2 + x / 10. for x in range(20)]
+            out = list(viderator.frame_iter(path, sample_fps=4))
+            # The first frame of each quarter second
+            self.assertEqual([round(x[1], 3) for x in out],
+                             [round(min(t for t in times if t > x / 4. - 1e-6), 3)
+                              for x in range(16)])
+            # Numbered by their index in the video, not their time * fps
+            full = list(viderator.frame_iter(path))
+            nums = dict((round(t, 3), n) for n, t in enumerate(times))
+            for kw in [{'sample_fps': 4}, {'scene_threshold': .001}, {'keyframes': True},
+                       {'sample_fps': 4, 'start_time': 1.}]:
+                if 'start_time' in kw:
+                    # After a seek the frames are found in the sidecar index
+                    viderator.build_index(path)
+                out = list(viderator.frame_iter(path, **kw))
+                self.assertTrue(out[-1][0] > 60)
+                for frame_num, frame_time, frame in out:
+                    self.assertEqual(frame_num, nums[round(frame_time, 3)])
+                    self.assertTrue(np.all(frame == full[frame_num][2]))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_frozen_cache(self):
+        import viderator
+        import viderator.main
+        import subprocess
+        import threading
+        import tempfile
+        import tarfile
+        import shutil
+        import os
+        tmpdir = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        cache_dir = viderator.main.FROZEN_CACHE_DIR
+        try:
+            f = tarfile.open(os.path.join(tmpdir, 'ffmpegbin.tar'), 'w')
+            for program in ('ffmpeg', 'ffprobe'):
+                path = subprocess.Popen(['which', program], stdout=subprocess.PIPE).communicate()[0]
+                f.add(path.strip(), arcname=program)
+            f.close()
+            viderator.main.FROZEN_CACHE_DIR = os.path.join(tmpdir, 'cache')
+            video = os.path.abspath(self.video)
+            ref = [x[:2] for x in viderator.frame_iter(video, max_frames=5)]
+            os.chdir(tmpdir)
+            # Extracted once by concurrent callers
+            dirs = []
+            threads = [threading.Thread(target=lambda: dirs.append(
+                viderator.main._extract_bundle('ffmpegbin.tar'))) for x in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(set(dirs)), 1)
+            self.assertEqual([x for x in os.listdir('cache') if not x.endswith('.lock')],
+                             [os.path.basename(dirs[0])])
+            self.assertEqual([x[:2] for x in viderator.frame_iter(video, frozen=True, max_frames=5)], ref)
+            self.assertEqual(viderator.main._ffmpeg_command(True)[0], os.path.join(dirs[0], 'ffmpeg'))
+            # Only the user's private directories are trusted
+            if 'VIDERATOR_FFMPEG_CACHE' not in os.environ:
+                self.assertTrue(str(os.getuid()) in os.path.basename(cache_dir))
+            self.assertEqual(os.stat('cache').st_mode & 0777, 0700)
+            os.chmod(dirs[0], 0777)
+            self.assertRaises(IOError, viderator.main._extract_bundle, 'ffmpegbin.tar')
+            os.chmod(dirs[0], 0700)
+            os.chmod('cache', 0777)
+            self.assertRaises(IOError, viderator.main._extract_bundle, 'ffmpegbin.tar')
+            os.chmod('cache', 0700)
+            # A bundle without ffprobe can't probe
+            os.mkdir('ffmpeg_only')
+            os.chdir('ffmpeg_only')
+            f = tarfile.open('ffmpegbin.tar', 'w')
+            f.add(os.path.join(dirs[0], 'ffmpeg'), arcname='ffmpeg')
+            f.close()
+            self.assertRaises(IOError, viderator.frame_iter(video, frozen=True).next)
+        finally:
+            os.chdir(cwd)
+            viderator.main.FROZEN_CACHE_DIR = cache_dir
+            viderator.main._frozen_dirs.clear()
+            shutil.rmtree(tmpdir)
+
+    def test_bindepend(self):
+        from viderator import bindepend
+        import numpy as np
+        import subprocess
+        import re
+        lib = np.core._multiarray_umath.__file__
+        try:
+            out = subprocess.Popen(['ldd', lib], stdout=subprocess.PIPE).communicate()[0]
+        except OSError:
+            self.skipTest('ldd is not installed')
+        ref = [re.search(r'=> (\S+) \(', x) for x in out.splitlines()]
+        self.assertEqual(sorted(bindepend.getImports(lib)), sorted(x.group(1) for x in ref if x))
+        libs = bindepend.selectElfImports([lib, lib])
+        self.assertEqual(len(libs), len(set(libs)))
+        self.assertFalse(any(name.startswith('libc.so') for name, path in libs))
+
 
 if __name__ == '__main__':
     unittest.main()
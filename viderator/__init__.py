@@ -1,2 +1,11 @@
-from main import frame_iter
+from main import frame_iter, batch_iter, probe, FrameStats, yuv_planes
 from freeze_ffmpeg import freeze_ffmpeg
+from pool import pool_iter
+from segment import segment_iter
+from catalog import Catalog
+from index import build_index, load_index
+from reader import VideoReader
+from aio import aframe_iter
+from framecache import FrameCache
+from threads import tune_threads, decoder_threads
+from backends import available_backends
@@ -0,0 +1,186 @@
+"""Non-blocking frame iteration for event loops
+
+Uses trollius (the asyncio API for Python 2), so many videos can be decoded
+concurrently on one event loop without threads.
+"""
+import subprocess
+import tempfile
+import time
+import numpy as np
+from main import _ffmpeg_command, _probe_args, _parse_probe, _frame_args, yuv_planes
+from threads import decoder_threads
+try:
+    import trollius as asyncio
+    from trollius import From, Return
+except ImportError:
+    asyncio = None
+
+# The methods are only coroutines if trollius is installed
+_coroutine = asyncio.coroutine if asyncio else (lambda func: func)
+
+
+def _check_asyncio():
+    if asyncio is None:
+        raise ImportError('aframe_iter requires trollius (pip install trollius)')
+
+
+class AsyncFrameIter(object):
+    """Iterate over the frames of a video from a coroutine (see aframe_iter)
+
+    ffmpeg is started on the first next() and killed by close(), at the end
+    of the video, or when a next() is cancelled or fails.
+    """
+
+    def __init__(self, file_name, frozen=False, loop=None, stats=None, **kw):
+        _check_asyncio()
+        for key in ('scene_threshold', 'keyframes', 'sample_fps'):
+            if kw.get(key) not in (None, False):
+                raise ValueError("aframe_iter doesn't support %s" % key)
+        self.file_name = file_name
+        self.frozen = frozen
+        self.loop = loop
+        self.stats = stats
+        if stats is not None:
+            stats._started()
+        self._returned = None
+        self._closed = False
+        self._kw = kw
+        self._proc = None
+        self._errors = None
+        self._done = False
+
+    @_coroutine
+    def _exec(self, program, args, **kw):
+        program, env = _ffmpeg_command(self.frozen, program)
+        proc = yield From(asyncio.create_subprocess_exec(
+            program, *args, stdin=subprocess.PIPE, env=env, loop=self.loop,
+            **kw))
+        raise Return(proc)
+
+    @_coroutine
+    def _start(self):
+        proc = yield From(self._exec('ffprobe', _probe_args(self.file_name),
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE))
+        out, err = yield From(proc.communicate())
+        info = _parse_probe(self.file_name, proc.returncode, out, err)
+        kw = dict(self._kw)
+        if kw.get('threads') == 'auto':
+            # Off the loop, tuning decodes for a few seconds on first use
+            loop = self.loop or asyncio.get_event_loop()
+            threads, thread_type = yield From(loop.run_in_executor(
+                None, decoder_threads, 1, self.frozen))
+            kw['threads'] = threads
+            kw['thread_type'] = kw.get('thread_type') or thread_type
+        params = _frame_args(self.file_name, info, **kw)
+        if params is None:
+            self._done = True
+            return
+        args, self.fps, self.shape, frame_num = params[:4]
+        self._frame_skip = self._kw.get('frame_skip', 1)
+        self._frame_num = frame_num - self._frame_skip
+        self._frame_bytes = int(np.prod(self.shape))
+        # Errors go to a temp file (see _frame_pipe), the stdout buffer
+        # holds a whole frame
+        self._errors = tempfile.TemporaryFile()
+        self._proc = yield From(self._exec('ffmpeg', args, stdout=subprocess.PIPE,
+                                           stderr=self._errors,
+                                           limit=max(self._frame_bytes, 2 ** 16)))
+
+    @_coroutine
+    def next(self):
+        """Read the next frame (coroutine)
+
+        Returns:
+            Tuple of frame_num, frame_time, frame (see frame_iter, the frame is
+            read-only) or None at the end of the video
+
+        Raises:
+            IOError: Problem reading from ffmpeg
+        """
+        if self._done:
+            raise Return(None)
+        called = time.time()
+        if self.stats is not None and self._returned is not None:
+            self.stats.consumer_time += called - self._returned
+        try:
+            if self._proc is None:
+                yield From(self._start())
+                if self._done:
+                    raise Return(None)
+            start = time.time()
+            try:
+                data = yield From(self._proc.stdout.readexactly(self._frame_bytes))
+            except asyncio.IncompleteReadError:
+                self._done = True
+                if (yield From(self._proc.wait())):
+                    self._errors.seek(0)
+                    raise IOError(self._errors.read().strip() or 'ffmpeg failed')
+                self.close()
+                raise Return(None)
+        except Return:
+            raise
+        except BaseException:
+            # Includes cancellation, ffmpeg is killed right away
+            self.close()
+            raise
+        self._frame_num += self._frame_skip
+        if self.stats is not None:
+            self._returned = time.time()
+            self.stats._read(len(data), 1, self._frame_skip, self._returned - start)
+            self.stats.wait_time += self._returned - called
+            self.stats.frames_yielded += 1
+            self.stats._tick()
+        frame = np.frombuffer(data, dtype=np.uint8).reshape(self.shape)
+        if self._kw.get('pix_fmt') == 'yuv420p':
+            frame = yuv_planes(frame)
+        raise Return((self._frame_num, self._frame_num / self.fps, frame))
+
+    def close(self):
+        """Kill ffmpeg (if it's still running)"""
+        if self.stats is not None and not self._closed:
+            self.stats._tick(True)
+        self._closed = self._done = True
+        if self._proc is not None and self._proc.returncode is None:
+            try:
+                self._proc.kill()
+            except OSError:
+                pass
+        if self._errors is not None:
+            self._errors.close()
+            self._errors = None
+
+
+def aframe_iter(file_name, frozen=False, loop=None, **kw):
+    """Non-blocking version of frame_iter for trollius (asyncio) coroutines
+
+    ffprobe and ffmpeg run as event loop subprocesses and frames are read
+    from the pipe without blocking the loop.
+
+    Args:
+        file_name: video file to open
+        loop: Event loop (default is the current one)
+        stats: FrameStats to record timings and counters in (read_time is
+            the time waiting for each frame on the loop)
+        **kw: See frame_iter (except reuse_buffer, prefetch and the options
+            that drop frames in ffmpeg: scene_threshold, keyframes and
+            sample_fps)
+
+    Returns:
+        AsyncFrameIter, its next() coroutine returns frame_num, frame_time,
+        frame tuples (see frame_iter) and None at the end
+
+    Raises:
+        ImportError: trollius isn't installed
+        ValueError: An unsupported option
+
+    Example:
+        @trollius.coroutine
+        def count_frames(file_name):
+            frames = aframe_iter(file_name)
+            num_frames = 0
+            while (yield From(frames.next())) is not None:
+                num_frames += 1
+            raise Return(num_frames)
+    """
+    return AsyncFrameIter(file_name, frozen, loop, **kw)
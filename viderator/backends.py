@@ -0,0 +1,34 @@
+"""Decode backends of frame_iter
+
+'ffmpeg' runs the ffmpeg program and reads rawvideo from a pipe (see
+_FramePipe).  Another backend goes in BACKENDS and _frame_pipe, producing
+the same frames, numbered the same way, through the same
+readinto/frame_info/close interface, so everything built on frame_iter
+works with it.
+"""
+
+BACKENDS = ('ffmpeg',)
+
+
+def available_backends(frozen=False):
+    """Backends that can be used, in order of preference
+
+    The ffmpeg bundle of frozen=True is a program, a backend that isn't one
+    can't use it.
+    """
+    return list(BACKENDS)
+
+
+def choose_backend(backend=None, frozen=False):
+    """Backend to use, the preferred available one if backend is None
+
+    Raises:
+        ValueError: Unknown or unavailable backend
+    """
+    if backend is None:
+        return available_backends(frozen)[0]
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend %r (one of %s)' % (backend, ', '.join(BACKENDS)))
+    if backend not in available_backends(frozen):
+        raise ValueError("Backend %r isn't available" % backend)
+    return backend
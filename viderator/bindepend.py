@@ -34,8 +34,10 @@
 import os
 import time
 import string
+import struct
 import sys
 import re
+import threading
 from glob import glob
 
 seen = {}
@@ -671,6 +673,222 @@ def _getImports_otool(pth):
 
     return rslt
 
+# ELF dynamic tags and program header types read by _readElf
+DT_NULL, DT_NEEDED, DT_STRTAB, DT_STRSZ = 0, 1, 5, 10
+DT_SONAME, DT_RPATH, DT_RUNPATH = 14, 15, 29
+PT_LOAD, PT_DYNAMIC, PT_INTERP = 1, 2, 3
+
+# Parsed ELF binaries (path -> _readElf) and /etc/ld.so.cache, filled once
+# and shared by all threads
+_elfLock = threading.RLock()
+_elfInfos = {}
+_ldCache = None
+
+def _readElf(pth):
+    """Read the dynamic section of an ELF binary.
+
+        Return a dict with keys arch (class, byte order, machine), interp
+        (path of the dynamic loader or None), needed, soname, rpath and
+        runpath (lists of directories, $ORIGIN expanded) or None if PTH
+        isn't an ELF file.  Nothing is forked (no ldd or objdump)"""
+    f = open(pth, 'rb')
+    try:
+        ident = f.read(16)
+        if len(ident) < 16 or ident[:4] != '\x7fELF':
+            return None
+        elfclass = ord(ident[4])
+        end = ord(ident[5]) == 2 and '>' or '<'
+        if elfclass == 2:
+            ehdrfmt, phdrfmt, dynfmt = 'HHIQQQIHHH', 'IIQQQQQQ', 'qQ'
+        else:
+            ehdrfmt, phdrfmt, dynfmt = 'HHIIIIIHHH', 'IIIIIIII', 'iI'
+        ehdr = struct.unpack(end + ehdrfmt, f.read(struct.calcsize(end + ehdrfmt)))
+        machine, phoff, phentsize, phnum = ehdr[1], ehdr[4], ehdr[8], ehdr[9]
+        # (offset, vaddr, filesz) of the segments, the fields are ordered
+        # differently in ELF32 and ELF64
+        loads, dynamic, interp = [], None, None
+        for i in range(phnum):
+            f.seek(phoff + i * phentsize)
+            ph = struct.unpack(end + phdrfmt, f.read(struct.calcsize(end + phdrfmt)))
+            if elfclass == 2:
+                seg = ph[2], ph[3], ph[5]
+            else:
+                seg = ph[1], ph[2], ph[4]
+            if ph[0] == PT_LOAD:
+                loads.append(seg)
+            elif ph[0] == PT_DYNAMIC:
+                dynamic = seg
+            elif ph[0] == PT_INTERP:
+                f.seek(seg[0])
+                interp = f.read(seg[2]).split('\0')[0]
+        info = {'arch': (elfclass, end, machine), 'interp': interp, 'needed': [],
+                'soname': None, 'rpath': [], 'runpath': []}
+        if dynamic is None:
+            # static binary
+            return info
+        f.seek(dynamic[0])
+        data = f.read(dynamic[2])
+        dynsize = struct.calcsize(end + dynfmt)
+        entries = []
+        for i in range(0, len(data) - dynsize + 1, dynsize):
+            tag, val = struct.unpack(end + dynfmt, data[i:i + dynsize])
+            if tag == DT_NULL:
+                break
+            entries.append((tag, val))
+        tags = dict(entries)
+        # DT_STRTAB is an address, mapped to the file by the PT_LOAD segments
+        strtab = ''
+        for offset, vaddr, filesz in loads:
+            if vaddr <= tags.get(DT_STRTAB, -1) < vaddr + filesz:
+                f.seek(offset + tags[DT_STRTAB] - vaddr)
+                strtab = f.read(tags.get(DT_STRSZ, 0))
+                break
+    finally:
+        f.close()
+
+    def string_at(pos):
+        return strtab[pos:strtab.find('\0', pos)]
+    origin = os.path.dirname(os.path.abspath(pth))
+    for tag, val in entries:
+        if tag == DT_NEEDED:
+            info['needed'].append(string_at(val))
+        elif tag == DT_SONAME:
+            info['soname'] = string_at(val)
+        elif tag in (DT_RPATH, DT_RUNPATH):
+            dirs = string_at(val).replace('${ORIGIN}', origin).replace('$ORIGIN', origin)
+            info[tag == DT_RPATH and 'rpath' or 'runpath'] += \
+                [d for d in dirs.split(':') if d]
+    return info
+
+def getElfInfo(pth):
+    """Return _readElf(PTH), each binary is only read once."""
+    with _elfLock:
+        if pth not in _elfInfos:
+            try:
+                _elfInfos[pth] = _readElf(pth)
+            except (IOError, struct.error):
+                _elfInfos[pth] = None
+        return _elfInfos[pth]
+
+def _parseLdCache(pth='/etc/ld.so.cache'):
+    """Parse the ld.so cache (what ldconfig -p lists).
+
+        Return a dict of library name -> list of paths (all the
+        architectures, in the cache's order).  Reads the new
+        (glibc-ld.so.cache1.1) format, alone or after the old one, and the
+        old one"""
+    try:
+        f = open(pth, 'rb')
+        data = f.read()
+        f.close()
+    except IOError:
+        return {}
+    old, new = 'ld.so-1.7.0', 'glibc-ld.so.cache1.1'
+    start, entries = 0, []
+    if data.startswith(old):
+        nlibs = struct.unpack('=I', data[12:16])[0]
+        # The new format follows, aligned to 8 bytes
+        start = (16 + nlibs * 12 + 7) & ~7
+        if data[start:start + len(new)] != new:
+            strings = 16 + nlibs * 12
+            for i in range(nlibs):
+                flags, key, value = struct.unpack('=iII', data[16 + i * 12:28 + i * 12])
+                entries.append((strings + key, strings + value))
+            start = None
+    if start is not None:
+        if data[start:start + len(new)] != new:
+            return {}
+        nlibs = struct.unpack('=I', data[start + 20:start + 24])[0]
+        for i in range(nlibs):
+            pos = start + 48 + i * 24
+            flags, key, value = struct.unpack('=iII', data[pos:pos + 12])
+            # Offsets are from the start of the new format
+            entries.append((start + key, start + value))
+    cache = {}
+    for key, value in entries:
+        name = data[key:data.find('\0', key)]
+        cache.setdefault(name, []).append(data[value:data.find('\0', value)])
+    return cache
+
+def getLdCache():
+    """Return the parsed /etc/ld.so.cache, it's only read once."""
+    global _ldCache
+    with _elfLock:
+        if _ldCache is None:
+            _ldCache = _parseLdCache()
+        return _ldCache
+
+def _findElfLibrary(name, info, rpath):
+    """Resolve a DT_NEEDED NAME of a binary like ld.so does.
+
+        INFO is the binary's getElfInfo and RPATH the DT_RPATHs of it and
+        its loaders.  Only libraries of the binary's architecture match.
+        Return the path or None"""
+    def matches(pth):
+        lib = os.path.isfile(pth) and getElfInfo(pth)
+        return bool(lib) and lib['arch'] == info['arch']
+    if '/' in name:
+        return matches(name) and name or None
+    dirs = []
+    if not info['runpath']:
+        dirs += rpath
+    dirs += [d for d in os.environ.get('LD_LIBRARY_PATH', '').split(':') if d]
+    dirs += info['runpath']
+    for pth in [os.path.join(d, name) for d in dirs] + getLdCache().get(name, []) + \
+            [os.path.join(d, name) for d in ('/lib64', '/usr/lib64', '/lib', '/usr/lib')]:
+        if matches(pth):
+            return pth
+    return None
+
+def getElfClosure(pths):
+    """Find the binary dependencies of the ELF binaries PTHS, with their
+        dependencies (like ldd, without running it).
+
+        Several binaries (e.g., ffmpeg and ffprobe) share one walk.  The
+        dynamic loader isn't included.  Return a list of paths, in the
+        order they're found"""
+    rslt = []
+    resolved = {}
+    interps = set()
+    queue = [(pth, []) for pth in pths]
+    while queue:
+        pth, rpath = queue.pop(0)
+        info = getElfInfo(pth)
+        if info is None:
+            continue
+        if info['interp']:
+            interps.add(os.path.basename(info['interp']))
+        # The loader chain's RPATHs apply too (if there's no RUNPATH)
+        rpath = info['rpath'] + rpath
+        for name in info['needed']:
+            # ld.so loads each name once
+            if name in resolved or os.path.basename(name) in interps:
+                continue
+            lib = _findElfLibrary(name, info, rpath)
+            resolved[name] = lib
+            if lib is None:
+                print 'E: cannot find %s (needed by %s)' % (name, pth)
+                continue
+            rslt.append(lib)
+            queue.append((lib, rpath))
+    return [lib for lib in rslt if os.path.basename(lib) not in interps]
+
+def selectElfImports(pths):
+    """Return the dependencies of the ELF binaries PTHS that should be
+    included, like selectImports but without the module global SEEN, so
+    it's thread-safe.
+
+    Return a list of pairs (name, fullpath)
+    """
+    rv = []
+    for lib in getElfClosure(pths):
+        if excludesRe.search(lib) and lib.find('libpython') < 0:
+            if not silent:
+                print "I: Skipping", lib
+            continue
+        rv.append((os.path.basename(lib), lib))
+    return rv
+
 def getImports(pth, platform=sys.platform):
     """Forwards to the correct getImports implementation for the platform.
     """
@@ -696,7 +914,7 @@ def getImports(pth, platform=sys.platform):
     elif platform == 'darwin':
         return _getImports_otool(pth)
     else:
-        return _getImports_ldd(pth)
+        return getElfClosure([pth])
 
 def getWindowsPath():
     """Return the path that Windows will search for dlls."""
@@ -740,10 +958,11 @@ def findLibrary(name):
 
     # Look in /etc/ld.so.cache
     if lib is None:
-        expr = r'/[^\(\)\s]*%s\.[^\(\)\s]*' % re.escape(name)
-        m = re.search(expr, os.popen('/sbin/ldconfig -p 2>/dev/null').read())
-        if m:
-            lib = m.group(0)
+        cache = getLdCache()
+        for key in sorted(cache):
+            if key.startswith(name + '.'):
+                lib = cache[key][0]
+                break
 
     # Look in the known safe paths
     if lib is None:
@@ -763,9 +982,9 @@ def findLibrary(name):
 
 def getSoname(filename):
     """Return the soname of a library."""
-    cmd = "objdump -p -j .dynamic 2>/dev/null " + filename
-    m = re.search(r'\s+SONAME\s+([^\s]+)', os.popen(cmd).read())
-    if m: return m.group(1)
+    info = getElfInfo(filename)
+    if info:
+        return info['soname']
 
 
 if __name__ == "__main__":
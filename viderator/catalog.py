@@ -0,0 +1,151 @@
+import multiprocessing
+import fractions
+import sqlite3
+import json
+import os
+from main import probe
+
+VIDEO_EXTENSIONS = ('.avi', '.flv', '.m4v', '.mkv', '.mov', '.mp4', '.mpeg',
+                    '.mpg', '.ogv', '.ts', '.webm', '.wmv')
+
+
+def _probe_file(args):
+    """Probe one file in a pool worker
+
+    Returns:
+        Tuple of path, size, mtime, info, error (info is None on error)
+    """
+    path, size, mtime, frozen = args
+    try:
+        return path, size, mtime, probe(path, frozen), None
+    except IOError, e:
+        return path, size, mtime, None, str(e)
+
+
+def _list_videos(source, extensions=VIDEO_EXTENSIONS):
+    """List video paths from a directory (recursive), manifest file or list
+
+    A manifest is a text file with one path per line (blank lines and lines
+    starting with # are skipped), relative paths are relative to it.
+    """
+    if not isinstance(source, basestring):
+        return [os.path.abspath(x) for x in source]
+    if os.path.isdir(source):
+        paths = []
+        for dir_path, dir_names, file_names in os.walk(source):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if os.path.splitext(file_name)[1].lower() in extensions:
+                    paths.append(os.path.abspath(os.path.join(dir_path, file_name)))
+        return paths
+    base = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source) as fp:
+        for line in fp:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                paths.append(os.path.abspath(os.path.join(base, line)))
+    return paths
+
+
+class Catalog(object):
+    """Persistent index of video metadata (see probe) in a SQLite file
+
+    Entries are keyed by path, size and mtime, so a file is only probed again
+    when it changes.  Files ffprobe fails on are stored too (with their
+    error) so they aren't retried until they change.
+
+    Example:
+        catalog = Catalog('videos.db')
+        for path, info in catalog.scan('/data/videos').items():
+            print path, info and info['duration']
+    """
+
+    def __init__(self, db_path='viderator_catalog.db', frozen=False):
+        """
+        Args:
+            db_path: SQLite file (created if it doesn't exist)
+            frozen: use the ffprobe binary extracted from  ./ffmpegbin.tar
+        """
+        self.frozen = frozen
+        self.db = sqlite3.connect(db_path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS videos (path TEXT PRIMARY KEY, '
+                        'size INTEGER, mtime REAL, info TEXT, error TEXT)')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def _row(self, path):
+        return self.db.execute('SELECT size, mtime, info, error FROM videos '
+                               'WHERE path = ?', (path,)).fetchone()
+
+    @staticmethod
+    def _decode(info):
+        if info is None:
+            return None
+        info = dict((str(k), v) for k, v in json.loads(info).items())
+        info['fps'] = fractions.Fraction(info['fps'])
+        for key in ('codec', 'pix_fmt'):
+            info[key] = str(info[key])
+        return info
+
+    def lookup(self, path):
+        """Cached info of a file, None if it isn't cached, changed or failed
+
+        Raises:
+            OSError: The file doesn't exist
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self._row(path)
+        if row is None or row[0] != st.st_size or row[1] != st.st_mtime:
+            return None
+        return self._decode(row[2])
+
+    def error(self, path):
+        """ffprobe's error for a file (None if it didn't fail or isn't cached)"""
+        row = self._row(os.path.abspath(path))
+        return None if row is None else row[3]
+
+    def scan(self, source, num_workers=None, extensions=VIDEO_EXTENSIONS):
+        """Probe the new or changed videos and return the info of all of them
+
+        Args:
+            source: Directory (searched recursively for extensions), manifest
+                file (one path per line) or list of paths
+            num_workers: Number of ffprobes run at once (default is the
+                number of cpus)
+            extensions: File extensions (lower case) used for directories
+
+        Returns:
+            Dict of absolute path -> info (see probe), None if probing failed
+        """
+        out = {}
+        todo = []
+        for path in _list_videos(source, extensions):
+            try:
+                st = os.stat(path)
+            except OSError:
+                out[path] = None
+                continue
+            row = self._row(path)
+            if row is not None and row[0] == st.st_size and row[1] == st.st_mtime:
+                out[path] = self._decode(row[2])
+            else:
+                todo.append((path, st.st_size, st.st_mtime, self.frozen))
+        if todo:
+            pool = multiprocessing.Pool(num_workers)
+            try:
+                for path, size, mtime, info, error in pool.imap_unordered(_probe_file, todo):
+                    out[path] = info
+                    if info is not None:
+                        info = json.dumps(dict(info, fps=str(info['fps'])))
+                    self.db.execute('INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?)',
+                                    (path, size, mtime, info, error))
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+                self.db.commit()
+        return out
@@ -0,0 +1,206 @@
+import hashlib
+import tempfile
+import json
+import os
+import numpy as np
+from main import frame_iter, yuv_planes
+
+# Bumped when the entry format changes, older entries are never matched
+_CACHE_VERSION = 1
+
+
+class FrameCache(object):
+    """Decode-once on-disk cache of the frames of videos
+
+    The first pass over a video (with some decode options) writes its frames
+    to a raw file in cache_dir while they are yielded; later passes with the
+    same options read them back with np.memmap, nothing is decoded.  Each
+    entry is a raw file (frames back to back) and a small JSON header (shape,
+    frame numbers and times).  Entries are keyed by the video's path, size
+    and mtime and the decode options, so a changed video is decoded again.
+    When the cache is over max_bytes the least recently used entries are
+    deleted.
+
+    Example:
+        cache = FrameCache('/tmp/frames', max_bytes=50 * 2 ** 30)
+        for frame_num, frame_time, frame in cache.frame_iter('video.mp4', size=(224, 224)):
+            pass
+        frame_nums, frame_times, frames = cache.get('video.mp4', size=(224, 224))
+    """
+
+    def __init__(self, cache_dir, max_bytes=10 * 2 ** 30, frozen=False):
+        """
+        Args:
+            cache_dir: Directory of the entries (created if it doesn't exist)
+            max_bytes: Disk budget of the entries, the last entry written is
+                kept even if it's larger
+            frozen: use the ffmpeg binary extracted from  ./ffmpegbin.tar
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.frozen = frozen
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _key(self, file_name, kw):
+        file_name = os.path.abspath(file_name)
+        st = os.stat(file_name)
+        options = dict(frame_skip=1, pix_fmt='bgr24', start_time=0.,
+                       end_time=None, max_frames=None, size=None, crop=None)
+        options.update(kw)
+        for key in ('size', 'crop'):
+            if options[key] is not None:
+                options[key] = list(options[key])
+        key = json.dumps([_CACHE_VERSION, file_name, st.st_size, st.st_mtime,
+                          sorted(options.items())])
+        return hashlib.sha1(key).hexdigest()
+
+    def _paths(self, key):
+        path = os.path.join(self.cache_dir, key)
+        return path + '.json', path + '.raw'
+
+    def get(self, file_name, **kw):
+        """Cached frames of a video
+
+        Args:
+            file_name: video file
+            **kw: Decode options (see frame_iter)
+
+        Returns:
+            Tuple of frame_nums, frame_times, frames or None if they aren't
+            cached where frames is a read-only np.memmap of shape
+            (num_frames,) + frame shape, slicing it doesn't copy or read
+            (yuv420p frames are (height * 3 / 2, width), see yuv_planes)
+
+        Raises:
+            OSError: The video doesn't exist
+        """
+        header_path, raw_path = self._paths(self._key(file_name, kw))
+        try:
+            with open(header_path) as fp:
+                header = json.load(fp)
+            # Used now (the LRU order is the header mtimes)
+            os.utime(header_path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        shape = (len(header['frame_nums']),) + tuple(header['shape'])
+        if not shape[0]:
+            frames = np.empty(shape, dtype=np.uint8)
+        else:
+            try:
+                frames = np.memmap(raw_path, dtype=np.uint8, mode='r', shape=shape)
+            except (IOError, ValueError):
+                return None
+        return header['frame_nums'], header['frame_times'], frames
+
+    def frame_iter(self, file_name, **kw):
+        """frame_iter that reads the frames from the cache, decoding and
+        caching them if needed
+
+        The frames are only cached if the iteration runs to the end.
+
+        Args:
+            file_name: video file to open
+            **kw: See frame_iter (reuse_buffer, prefetch and stats only
+                apply when decoding and aren't part of the key)
+
+        Yields:
+            Tuple of frame_num, frame_time, frame (see frame_iter), cached
+            frames are read-only memmap views
+
+        Raises:
+            IOError: Problem reading from ffmpeg
+        """
+        decode_kw = dict((k, kw.pop(k)) for k in ('reuse_buffer', 'prefetch', 'stats')
+                         if k in kw)
+        yuv = kw.get('pix_fmt') == 'yuv420p'
+        cached = self.get(file_name, **kw)
+        if cached is not None:
+            for frame_num, frame_time, frame in zip(*cached):
+                yield frame_num, frame_time, yuv_planes(frame) if yuv else frame
+            return
+        header_path, raw_path = self._paths(self._key(file_name, kw))
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            frame_nums, frame_times, shape = [], [], None
+            with os.fdopen(fd, 'wb') as fp:
+                for frame_num, frame_time, frame in frame_iter(
+                        file_name, self.frozen, **dict(kw, **decode_kw)):
+                    # The Y, U and V planes back to back are the raw frame
+                    for plane in frame if yuv else [frame]:
+                        plane.tofile(fp)
+                    frame_nums.append(frame_num)
+                    frame_times.append(frame_time)
+                    if yuv:
+                        shape = (frame[0].shape[0] * 3 // 2, frame[0].shape[1])
+                    else:
+                        shape = frame.shape
+                    yield frame_num, frame_time, frame
+            # The raw file is in place before its header, a header always
+            # has its frames
+            os.rename(tmp_path, raw_path)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as fp:
+                json.dump({'shape': shape or [], 'frame_nums': frame_nums,
+                           'frame_times': frame_times}, fp)
+            os.rename(tmp_path, header_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict(keep=header_path)
+
+    def _entries(self):
+        """List the entries, least recently used first
+
+        Returns:
+            List of (used time, bytes, header_path, raw_path)
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            header_path, raw_path = self._paths(name[:-5])
+            try:
+                used = os.stat(header_path).st_mtime
+                num_bytes = os.path.getsize(header_path)
+                if os.path.exists(raw_path):
+                    num_bytes += os.path.getsize(raw_path)
+            except OSError:
+                continue
+            entries.append((used, num_bytes, header_path, raw_path))
+        entries.sort()
+        return entries
+
+    def size(self):
+        """Bytes used by the entries"""
+        return sum(x[1] for x in self._entries())
+
+    def evict(self, keep=None):
+        """Delete the least recently used entries until the cache fits in
+        max_bytes
+
+        Args:
+            keep: Header path of an entry that isn't deleted
+        """
+        entries = self._entries()
+        total = sum(x[1] for x in entries)
+        for used, num_bytes, header_path, raw_path in entries:
+            if total <= self.max_bytes:
+                break
+            if header_path == keep:
+                continue
+            # Header first, an entry without one is never read
+            for path in (header_path, raw_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= num_bytes
+
+    def clear(self):
+        """Delete all the entries"""
+        max_bytes, self.max_bytes = self.max_bytes, -1
+        try:
+            self.evict()
+        finally:
+            self.max_bytes = max_bytes
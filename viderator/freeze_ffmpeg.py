@@ -5,6 +5,7 @@ import os
 import tempfile
 import shutil
 import subprocess
+import sys
 
 bindepend.silent = True
 
@@ -19,7 +20,7 @@ def freeze_ffmpeg(preset_path='~/ffmpegbin.tar'):
         absolute path to a tar file
 
     Raises:
-        OSError:  FFMPEG not found.
+        OSError:  FFMPEG or FFPROBE not found (or not in the preset tar).
 
     Example:
         with freeze_ffmpeg() as ffmpegtar:
@@ -30,6 +31,12 @@ def freeze_ffmpeg(preset_path='~/ffmpegbin.tar'):
     """
     preset_path = os.path.expanduser(preset_path)
     if os.path.exists(preset_path):
+        f = tarfile.open(preset_path)
+        names = f.getnames()
+        f.close()
+        for program in ('ffmpeg', 'ffprobe'):
+            if program not in names:
+                raise OSError('%s is missing from %s!' % (program, preset_path))
         yield preset_path
         return
     try:
@@ -44,14 +51,29 @@ def main():
     program = proc.stdout.read().strip()
     if not program:
         raise OSError('ffmpeg not installed!')
-    libs = bindepend.selectImports(program)
+    # ffprobe reads the video metadata before every decode, it's required
+    proc = subprocess.Popen('which ffprobe', shell=True, stdout=subprocess.PIPE)
+    ffprobe = proc.stdout.read().strip()
+    if not ffprobe:
+        raise OSError('ffprobe not installed!')
+    programs = [program, ffprobe]
+    if sys.platform.startswith('linux'):
+        # One walk of the ELF dependencies of both programs, nothing is forked
+        libs = bindepend.selectElfImports(programs)
+    else:
+        libs = []
+        for program in programs:
+            libs += bindepend.selectImports(program)
 
     tmpdir = tempfile.mkdtemp()
     tar = os.path.join(tmpdir, 'ffmpegbin.tar')
     f = tarfile.open(tar, 'w')
     f.dereference = True  # for Python 2.4 compatibility, this is not in constructor
-    for _, fn in libs + [('', program)]:
-        f.add(fn, arcname=os.path.basename(fn))
+    arcnames = set()
+    for _, fn in libs + [('', x) for x in programs]:
+        if os.path.basename(fn) not in arcnames:
+            arcnames.add(os.path.basename(fn))
+            f.add(fn, arcname=os.path.basename(fn))
     f.close()
     return tmpdir, tar
 
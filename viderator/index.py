@@ -0,0 +1,134 @@
+import fractions
+import json
+import os
+from main import _ffmpeg_popen, probe
+
+# Bumped when the sidecar format changes, older sidecars are rebuilt
+_INDEX_VERSION = 1
+
+
+def _read_packets(file_name, frozen=False):
+    """Read the video packet times and keyframe flags with ffprobe
+
+    Only the container is parsed, nothing is decoded.
+
+    Args:
+        file_name: video file to open
+        frozen: use the ffprobe binary extracted from  ./ffmpegbin.tar
+
+    Returns:
+        Tuple of times, keyframes where
+        times: Sorted presentation times (sec) of the frames, relative to the
+            start of the file (the same time base as ffmpeg's -ss)
+        keyframes: Sorted frame numbers (indices in times) of the keyframes
+
+    Raises:
+        IOError: Problem reading from ffprobe
+    """
+    proc = _ffmpeg_popen(['-v', 'error', '-select_streams', 'v:0',
+                          '-show_entries', 'packet=pts_time,dts_time,flags:format=start_time',
+                          '-of', 'compact', file_name], frozen, 'ffprobe')
+    out, err = proc.communicate()
+    if proc.returncode:
+        raise IOError(err.strip() or 'ffprobe failed on %s' % file_name)
+    start_time = 0.
+    packets = []
+    for line in out.splitlines():
+        # packet|pts_time=0.133467|dts_time=-0.033367|flags=___
+        # format|start_time=0.000000
+        fields = line.split('|')
+        values = dict(x.split('=', 1) for x in fields[1:] if '=' in x)
+        if fields[0] == 'format':
+            try:
+                start_time = float(values.get('start_time'))
+            except (TypeError, ValueError):
+                pass
+            continue
+        flags = values.get('flags', '')
+        # Discarded packets (edit lists) are never output by the decoder
+        if 'D' in flags:
+            continue
+        for key in ('pts_time', 'dts_time'):
+            try:
+                packets.append((float(values[key]), 'K' in flags))
+                break
+            except (KeyError, ValueError):
+                pass
+    if not packets:
+        raise IOError("couldn't read packets from ffprobe output")
+    packets.sort()
+    times = [x[0] - start_time for x in packets]
+    keyframes = [num for num, x in enumerate(packets) if x[1]]
+    return times, keyframes
+
+
+def _index_path(file_name, index_path=None):
+    return file_name + '.vidx' if index_path is None else index_path
+
+
+def build_index(file_name, frozen=False, index_path=None):
+    """Build a frame/keyframe index of a video and save it in a sidecar file
+
+    Args:
+        file_name: video file to open
+        frozen: use the ffprobe binary extracted from  ./ffmpegbin.tar
+        index_path: Sidecar file (default is file_name + '.vidx'), if it
+            can't be written the index is only returned
+
+    Returns:
+        Dict with keys
+        fps: Frame rate (fractions.Fraction, see probe)
+        times: Presentation time (sec) of every frame (see _read_packets)
+        keyframes: Frame numbers of the keyframes
+
+    Raises:
+        IOError: Problem reading from ffprobe
+        OSError: The video doesn't exist
+    """
+    st = os.stat(file_name)
+    times, keyframes = _read_packets(file_name, frozen)
+    index = {'fps': probe(file_name, frozen)['fps'], 'times': times,
+             'keyframes': keyframes}
+    try:
+        with open(_index_path(file_name, index_path), 'w') as fp:
+            json.dump({'version': _INDEX_VERSION, 'size': st.st_size,
+                       'mtime': st.st_mtime, 'fps': str(index['fps']),
+                       'times': times, 'keyframes': keyframes}, fp)
+    except IOError:
+        pass
+    return index
+
+
+def _cached_index(file_name, index_path=None):
+    """The sidecar index of a video (see build_index) or None if it's
+    missing or the video changed (size or mtime)"""
+    try:
+        st = os.stat(file_name)
+        with open(_index_path(file_name, index_path)) as fp:
+            data = json.load(fp)
+        if data['version'] == _INDEX_VERSION and data['size'] == st.st_size and \
+           data['mtime'] == st.st_mtime:
+            return {'fps': fractions.Fraction(data['fps']),
+                    'times': data['times'], 'keyframes': data['keyframes']}
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def load_index(file_name, frozen=False, index_path=None):
+    """Load the sidecar index of a video, (re)building it if it is missing or
+    the video changed (size or mtime)
+
+    Args:
+        See build_index
+
+    Returns:
+        See build_index
+
+    Raises:
+        IOError: Problem reading from ffprobe
+    """
+    index = _cached_index(file_name, index_path)
+    if index is None:
+        index = build_index(file_name, frozen, index_path)
+    return index
@@ -1,128 +1,1194 @@
 import subprocess
 import tarfile
+import hashlib
+import shutil
+import stat
+import io
 import os
-import re
+import math
+import bisect
 import sys
+import re
+import json
+import fractions
+import tempfile
+import threading
+import time
+import Queue
+import collections
 import numpy as np
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
+# Channels per pixel for the rawvideo pixel formats frame_iter can request,
+# yuv420p is planar (see yuv_planes)
+_PIX_FMT_CHANNELS = {'bgr24': 3, 'rgb24': 3, 'gray': 1}
+_PIX_FMTS = sorted(_PIX_FMT_CHANNELS) + ['yuv420p']
+# showinfo's time base and frame lines (at the level+info log level), of the
+# counter before the filters that drop frames or of the output
+_SHOWINFO_RE = re.compile(r'\[(showinfo@count|Parsed_showinfo_\d+) @ [^]]*\] \[info\] '
+                          r'(?:config in time_base: (\d+)/(\d+)|n: *(\d+) pts: *(-?\d+) )')
+_ERROR_RE = re.compile(r'\[(?:error|fatal|panic)\] (.*)')
+# Cache of extracted ffmpeg bundles (one directory per tar hash), per user
+# since its binaries are run as is
+FROZEN_CACHE_DIR = os.environ.get('VIDERATOR_FFMPEG_CACHE') or \
+    os.path.join(tempfile.gettempdir(), 'viderator_ffmpegbin-%d' % getattr(os, 'getuid', lambda: 0)())
+# Tar path -> extracted directory, resolved once per process
+_frozen_dirs = {}
+_frozen_lock = threading.Lock()
 
-def _read_fps(stderr):
-    """Read the fps from FFMpeg's debug output
-    """
-    
-    while 1:
-        line = stderr.readline()
-        print line.strip()
-        if 'Frame rate very high for a muxer not' in line:
-            raise IOError(line)
-        if ': No such file or directory' in line:
-            raise IOError(line)
-        if not line:
-            raise IOError("couldn't parse FPS from ffmpeg stderr")
-        # Method 0
-        # Stream #0.0: Video: mpeg4, yuv420p, 1280x720 [PAR 1:1 DAR 16:9], 29.97 fps, 29.97 tbr, 29.97 tbn, 30k tbc
-        m = re.search('Stream #.* Video: ppm,.* ([\.\d]+) fps\(c\)', line)
-        
-        if not m is None:
-            return float(m.groups()[0])
-        # Method 1
-        # Stream #0:0(und): Video: h264 (High) (avc1 / 0x31637661), yuv420p, 1280x720 [SAR 1:1 DAR 16:9], 1984 kb/s, 29.97 fps, 29.97 tbr, 30k tbn, 59.94 tbc
-        # Stream #0:0(und): Video: h264 (High) (avc1 / 0x31637661), yuv420p, 640x360 [SAR 1:1 DAR 16:9], 751 kb/s, 25 fps, 25 tbr, 25k tbn, 50 tbc
-        m = re.search('Stream #.* Video: .* ([\.\d]+) fps', line)
-        if not m is None:
-            return float(m.groups()[0])
-
-
-def _read_ppm(fp):
-    """Read one PPM image at a from a stream (ffmpeg image2pipe output)
-    """
-    l = fp.readline()[:-1]
-    assert l == 'P6'
-    l = fp.readline()[:-1]
-    try:
-        cols, rows = map(int, l.split())
-    except ValueError:  # No more images
+
+def _readinto(fp, buf):
+    """Fill a writable buffer from a stream, looping over short pipe reads
+
+    Returns:
+        Number of bytes read (less than len(buf) only at the end of the stream)
+    """
+    view = memoryview(buf)
+    size = len(view)
+    pos = 0
+    while pos < size:
+        n = fp.readinto(view[pos:])
+        if not n:
+            break
+        pos += n
+    return pos
+
+
+def _check_private(path):
+    """Check that a directory is owned by this user and only writable by it
+
+    Raises:
+        IOError: Another user could have written (or replace) its files
+    """
+    if not hasattr(os, 'getuid'):
         return
-    l = fp.readline().strip()
+    st = os.lstat(path)
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or
+            st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+        raise IOError("%s isn't a directory private to this user, its ffmpeg "
+                      "isn't trusted" % path)
+
+
+def _extract_bundle(tar_path, cache_dir=None):
+    """Extract an ffmpeg bundle into the user's cache, once per bundle
+
+    Bundles are keyed by the hash of the tar.  Concurrent processes wait on
+    a file lock while one of them extracts, into a temp directory that's
+    renamed into place, so a bundle directory is always complete.  The
+    cache and bundle directories must be owned by the user and not
+    writable by others, or they aren't used.
+
+    Args:
+        tar_path: Bundle made by freeze_ffmpeg
+        cache_dir: Cache directory (default is FROZEN_CACHE_DIR)
+
+    Returns:
+        Directory of the extracted binaries
+
+    Raises:
+        IOError: The cache or bundle directory isn't private to the user
+    """
+    cache_dir = cache_dir or FROZEN_CACHE_DIR
+    sha1 = hashlib.sha1()
+    with open(tar_path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(2 ** 20), ''):
+            sha1.update(chunk)
+    bundle_dir = os.path.join(cache_dir, sha1.hexdigest())
     try:
-        assert l == '255'
-    except:
-        print repr(l)
-        raise
-    frame = np.frombuffer(fp.read(cols * rows * 3), dtype=np.uint8).reshape((rows, cols, 3))
-    # Flip from RGB to BGR
-    return np.ascontiguousarray(frame[:, :, ::-1])
+        os.makedirs(cache_dir, 0700)
+    except OSError:
+        if not os.path.isdir(cache_dir):
+            raise
+    _check_private(cache_dir)
+    if os.path.isdir(bundle_dir):
+        _check_private(bundle_dir)
+        return bundle_dir
+    with open(bundle_dir + '.lock', 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        # Another process may have extracted it while we waited
+        if os.path.isdir(bundle_dir):
+            _check_private(bundle_dir)
+            return bundle_dir
+        tmp_dir = tempfile.mkdtemp(dir=cache_dir, suffix='.tmp')
+        try:
+            f = tarfile.open(tar_path)
+            f.extractall(tmp_dir)
+            f.close()
+            os.rename(tmp_dir, bundle_dir)
+        except OSError:
+            # Without fcntl the rename can lose the race, the winner's is kept
+            if not os.path.isdir(bundle_dir):
+                raise
+        finally:
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir)
+    return bundle_dir
 
 
-def frame_iter(file_name, frozen=False, frame_skip=1):
+def _ffmpeg_command(frozen=False, program='ffmpeg'):
+    """Path and environment to run ffmpeg (or ffprobe) with
+
+    Args:
+        frozen: use the ffmpeg binary extracted from  ./ffmpegbin.tar
+            (see vidfeat.freeze_ffmpeg), the bundle is extracted once per
+            user and node (see _extract_bundle) and its directory memoized
+        program: Program to run, 'ffmpeg' or 'ffprobe'
+
+    Returns:
+        Tuple of program, env (None to inherit it)
+
+    Raises:
+        IOError: The program isn't in the frozen bundle
     """
+    if frozen:
+        tar_path = os.path.abspath('ffmpegbin.tar')
+        ffmpegdir = _frozen_dirs.get(tar_path)
+        if ffmpegdir is None:
+            assert os.path.exists(tar_path), \
+                   "convert_video_ffmpeg was called with frozen=True, but \
+                   ffmpegbin.tar wasn't found. Make sure freeze_ffmpeg() was \
+                   passed to hadoopy.launch_frozen"
+            with _frozen_lock:
+                if tar_path not in _frozen_dirs:
+                    _frozen_dirs[tar_path] = _extract_bundle(tar_path)
+                ffmpegdir = _frozen_dirs[tar_path]
+        path = os.path.join(ffmpegdir, program)
+        if not os.path.isfile(path):
+            raise IOError("%s isn't in ffmpegbin.tar (rebuild it with freeze_ffmpeg)" % program)
+        return path, {'LD_LIBRARY_PATH': ffmpegdir}
+    return program, None
+
+
+def _ffmpeg_popen(args, frozen=False, program='ffmpeg', stderr=subprocess.PIPE):
+    """Launch ffmpeg with the given arguments, stdout/stdin/stderr are pipes
+
     Args:
-        filename: video file to open
+        args: List of ffmpeg arguments (without the program name)
         frozen: use the ffmpeg binary extracted from  ./ffmpegbin.tar
             (see vidfeat.freeze_ffmpeg)
-        frame_skip: How many frames to increment by (default 1 produces all frames,
-            2 skips every other one)
+        program: Program to run, 'ffmpeg' or 'ffprobe'
+        stderr: Where stderr goes (default is a pipe)
 
-    Yields:
-        Tuple of frame_num, frame_time, frame where
-        frame_num: Current frame number (starts at 0)
-        frame_time: Current video time (starts at 0., uses FPS taken from ffmpeg)
-        frame: Numpy array (bgr)
+    Returns:
+        subprocess.Popen instance
+    """
+    program, env = _ffmpeg_command(frozen, program)
+    return subprocess.Popen([program] + list(args),
+                            stdout=subprocess.PIPE,
+                            stdin=subprocess.PIPE,
+                            stderr=stderr,
+                            env=env, close_fds=True, shell=False)
+
+
+def _fraction(rate):
+    """Parse an ffprobe rational ('30000/1001'), None if unknown ('0/0')"""
+    try:
+        rate = fractions.Fraction(rate)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return rate if rate > 0 else None
+
+
+def _is_data(source):
+    """True if source is video data (or a file object) rather than a path
+
+    Paths can't contain NUL bytes, video data always does.
+    """
+    if isinstance(source, basestring):
+        return isinstance(source, str) and '\0' in source
+    return True
+
+
+def _rewindable(data):
+    """Video data that can be fed to ffmpeg twice (probe, then decode)
+
+    Seekable file objects are used as is, others are read into memory.
+    """
+    if not hasattr(data, 'read'):
+        return data
+    try:
+        data.seek(data.tell())
+        return data
+    except (AttributeError, IOError, ValueError):
+        return data.read()
+
+
+def _feed(stdin, data, chunk_size=2 ** 20):
+    """Write video data to ffmpeg's stdin from a thread, then close it
+
+    Stops quietly if ffmpeg exits (or is killed) before reading it all.
+
+    Args:
+        stdin: ffmpeg's stdin pipe
+        data: String, buffer (e.g., bytearray or memoryview) or file object
+            read from its current position
+
+    Returns:
+        The started writer thread
+    """
+    def _run():
+        try:
+            if hasattr(data, 'read'):
+                while True:
+                    chunk = data.read(chunk_size)
+                    if not chunk:
+                        break
+                    stdin.write(chunk)
+            else:
+                view = memoryview(data)
+                for pos in range(0, len(view), chunk_size):
+                    stdin.write(view[pos:pos + chunk_size])
+        except (IOError, OSError):
+            pass
+        finally:
+            try:
+                stdin.close()
+            except (IOError, OSError):
+                pass
+
+    thread = threading.Thread(target=_run)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def probe(file_name, frozen=False):
+    """Read a video's metadata with ffprobe (without decoding it)
+
+    Args:
+        file_name: video file to open or its data (see frame_iter)
+        frozen: use the ffprobe binary extracted from  ./ffmpegbin.tar
+            (see vidfeat.freeze_ffmpeg)
+
+    Returns:
+        Dict with keys
+        fps: Frame rate (fractions.Fraction)
+        width: Frame width (as stored, see rotation)
+        height: Frame height (as stored, see rotation)
+        duration: Duration (sec) or None if unknown
+        nb_frames: Number of frames or None if unknown
+        codec: Video codec name (e.g., 'h264')
+        pix_fmt: Pixel format of the decoded video (e.g., 'yuv420p')
+        rotation: Display rotation in degrees (0, 90, 180 or 270), ffmpeg
+            rotates the frames it outputs by this
 
     Raises:
-        IOError: Problem reading from ffmpeg
+        IOError: Problem reading from ffprobe or no video stream
+    """
+    if not _is_data(file_name):
+        proc = _ffmpeg_popen(_probe_args(file_name), frozen, 'ffprobe')
+        out, err = proc.communicate()
+        return _parse_probe(file_name, proc.returncode, out, err)
+    proc = _ffmpeg_popen(_probe_args('pipe:0'), frozen, 'ffprobe')
+    # A file object is rewound so that it can be decoded after
+    pos = file_name.tell() if hasattr(file_name, 'read') else None
+    # The writer thread owns stdin (communicate would close it)
+    writer = _feed(proc.stdin, file_name)
+    proc.stdin = None
+    out, err = proc.communicate()
+    writer.join()
+    if pos is not None:
+        file_name.seek(pos)
+    return _parse_probe('pipe:0', proc.returncode, out, err)
+
+
+def _probe_args(file_name):
+    return ['-v', 'error', '-print_format', 'json', '-show_streams',
+            '-show_format', '-select_streams', 'v:0', file_name]
+
+
+def _parse_probe(file_name, returncode, out, err):
+    """Parse the output of ffprobe run with _probe_args (see probe)"""
+    if returncode:
+        raise IOError(err.strip() or 'ffprobe failed on %s' % file_name)
+    try:
+        info = json.loads(out)
+        stream = info['streams'][0]
+    except (ValueError, KeyError, IndexError):
+        raise IOError('No video stream in %s' % file_name)
+    fmt = info.get('format', {})
+    fps = _fraction(stream.get('avg_frame_rate')) or \
+          _fraction(stream.get('r_frame_rate'))
+    if fps is None:
+        raise IOError("couldn't read the frame rate of %s" % file_name)
+    duration = stream.get('duration', fmt.get('duration'))
+    nb_frames = stream.get('nb_frames')
+    # Older ffprobes have a rotate tag, newer ones a display matrix
+    rotation = stream.get('tags', {}).get('rotate', 0)
+    for side_data in stream.get('side_data_list', []):
+        rotation = side_data.get('rotation', rotation)
+    return {'fps': fps,
+            'width': int(stream['width']),
+            'height': int(stream['height']),
+            'duration': None if duration is None else float(duration),
+            'nb_frames': None if nb_frames is None else int(nb_frames),
+            'codec': str(stream.get('codec_name')),
+            'pix_fmt': str(stream.get('pix_fmt')),
+            'rotation': int(round(float(rotation))) % 360}
+
+
+class FrameStats(object):
+    """Counters and timings of frame_iter/batch_iter, to find the bottleneck
+
+    Pass one as stats= and read it during or after the iteration (it
+    accumulates over every iterator it's passed to).  If read_time is close
+    to elapsed ffmpeg (decode or seek) is the bottleneck, if consumer_time
+    is the consumer is.
+
+    Attributes:
+        startup_time: Sec from the call (probe and ffmpeg launch included)
+            to the first frame arriving from ffmpeg
+        bytes_read: Bytes read from the ffmpeg pipe
+        frames_read: Frames read from the ffmpeg pipe
+        frames_decoded: Frames ffmpeg decoded for them (frames_read times
+            frame_skip, the skipped frames are decoded too).  Counted by
+            ffmpeg up to the last frame read when it drops frames
+            (scene_threshold, sample_fps), with keyframes only the
+            keyframes are decoded
+        frames_yielded: Frames yielded to the consumer (frames in batches
+            for batch_iter)
+        read_time: Sec blocked reading the pipe (in the prefetch thread if
+            prefetch is used)
+        wait_time: Sec the consumer waited for the next frame (equal to
+            read_time plus overhead without prefetch)
+        consumer_time: Sec spent in the consumer between frames
+    """
+
+    def __init__(self, hook=None, interval=10.):
+        """
+        Args:
+            hook: Called with this object at most every interval sec during
+                the iteration and once when an iterator finishes (e.g., to
+                update Hadoop counters)
+            interval: Min sec between hook calls
+        """
+        self.hook = hook
+        self.interval = interval
+        self.reset()
+
+    def reset(self):
+        self.start = None
+        self.startup_time = None
+        self.bytes_read = 0
+        self.frames_read = 0
+        self.frames_decoded = 0
+        self.frames_yielded = 0
+        self.read_time = 0.
+        self.wait_time = 0.
+        self.consumer_time = 0.
+        self._last_hook = None
+
+    @property
+    def elapsed(self):
+        """Sec since the first call using this object"""
+        return 0. if self.start is None else time.time() - self.start
+
+    @property
+    def fps(self):
+        """Frames yielded per sec (startup included)"""
+        elapsed = self.elapsed
+        return self.frames_yielded / elapsed if elapsed else 0.
+
+    def to_dict(self):
+        return dict((key, getattr(self, key))
+                    for key in ('startup_time', 'bytes_read', 'frames_read',
+                                'frames_decoded', 'frames_yielded', 'read_time',
+                                'wait_time', 'consumer_time', 'elapsed', 'fps'))
+
+    def _started(self):
+        if self.start is None:
+            self.start = self._last_hook = time.time()
+
+    def _read(self, num_bytes, frames, frames_decoded, read_time):
+        if self.startup_time is None and num_bytes:
+            self.startup_time = time.time() - self.start
+        self.bytes_read += num_bytes
+        self.frames_read += frames
+        self.frames_decoded += frames_decoded
+        self.read_time += read_time
+
+    def _tick(self, force=False):
+        if self.hook is not None and (force or time.time() - self._last_hook >= self.interval):
+            self._last_hook = time.time()
+            self.hook(self)
+
+
+def _read_log(stderr, times, errors):
+    """Parse the stderr of an ffmpeg with showinfo (see _FramePipe)
+
+    Args:
+        stderr: ffmpeg's stderr pipe, read to the end
+        times: Queue the (n, pts, time_base) of the output frames are put
+            in, None at the end, n is the frame's count before the filters
+            that drop frames (None without the counter) and pts * time_base
+            its timestamp (sec, time_base is a fractions.Fraction)
+        errors: List the error messages are appended to
+    """
+    time_base = None
+    # pts, n of the counted frames not output yet (in pts order, the filters
+    # don't change timestamps)
+    counted = collections.deque()
+    for line in iter(stderr.readline, ''):
+        match = _SHOWINFO_RE.search(line)
+        if match is None:
+            match = _ERROR_RE.search(line)
+            if match is not None:
+                errors.append(match.group(1).strip())
+        elif match.group(1) == 'showinfo@count':
+            if match.group(4):
+                counted.append((int(match.group(5)), int(match.group(4))))
+        elif match.group(2):
+            time_base = fractions.Fraction(int(match.group(2)), int(match.group(3)))
+        else:
+            pts = int(match.group(5))
+            while counted and counted[0][0] < pts:
+                counted.popleft()
+            n = counted.popleft()[1] if counted and counted[0][0] == pts else None
+            times.put((n, pts, time_base))
+    times.put(None)
+
+
+class _FramePipe(object):
+    """A running ffmpeg writing rawvideo frames to its stdout (see _frame_pipe)
+
+    Attributes:
+        proc: ffmpeg subprocess.Popen instance
+        stdout: Unbuffered binary stream of frames (supports readinto)
+        fps: Frame rate (float)
+        shape: Shape of one frame
+        first_frame: Number of the first frame
+        frame_skip: Frame number increment
+        writer: Thread feeding the video data to ffmpeg's stdin (or None)
+        stats: FrameStats updated by readinto (or None)
+        time_offset: If not None, ffmpeg drops frames (e.g., scene_threshold)
+            and the frame times are read from showinfo on stderr in a
+            thread, offset by this (the input seek, ffmpeg rounds it to the
+            time base so the times are put back on its ticks)
+        counted: If True, showinfo counts the frames before ffmpeg drops
+            them (from the seek), frames_decoded is its count
+        frames_decoded: Number of frames decoded for the frames read
+        frame_times: Tuple of the sorted times, numbers of the video's
+            frames (from its packets) the frames are matched with when
+            ffmpeg doesn't count them (after a seek, or with keyframes), or
+            None to number them from their times (approximate on variable
+            frame rate videos)
+    """
+
+    def __init__(self, proc, errors, fps, shape, first_frame, frame_skip,
+                 writer=None, time_offset=None, frame_times=None, counted=False):
+        self.proc = proc
+        self.errors = errors
+        self.writer = writer
+        # Frames are read directly into numpy arrays, without the file
+        # object's copy
+        self.stdout = io.open(proc.stdout.fileno(), 'rb', buffering=0,
+                              closefd=False)
+        self.fps = fps
+        self.shape = shape
+        self.first_frame = first_frame
+        self.frame_skip = frame_skip
+        self.frame_bytes = int(np.prod(shape))
+        self.stats = None
+        self.time_offset = time_offset
+        self.frame_times = frame_times
+        self.counted = counted
+        self.frames_decoded = 0
+        self._next_frame = first_frame
+        if time_offset is not None:
+            # stderr is drained in a thread, ffmpeg never blocks on it
+            self._times = Queue.Queue()
+            self._log_errors = []
+            self._log_thread = threading.Thread(
+                target=_read_log, args=(proc.stderr, self._times, self._log_errors))
+            self._log_thread.daemon = True
+            self._log_thread.start()
+
+    def readinto(self, buf):
+        """Fill buf with frames
+
+        Returns:
+            Number of bytes read (less than len(buf) only at the end)
+
+        Raises:
+            IOError: ffmpeg failed
+        """
+        start = time.time()
+        num_bytes = _readinto(self.stdout, buf)
+        # The counted frames are added by frame_info
+        decoded = 0 if self.counted else num_bytes // self.frame_bytes * self.frame_skip
+        self.frames_decoded += decoded
+        if self.stats is not None:
+            self.stats._read(num_bytes, num_bytes // self.frame_bytes,
+                             decoded, time.time() - start)
+        if num_bytes < len(memoryview(buf)) and self.proc.wait():
+            if self.errors is None:
+                self._log_thread.join()
+                raise IOError('\n'.join(self._log_errors) or 'ffmpeg failed')
+            self.errors.seek(0)
+            raise IOError(self.errors.read().strip() or 'ffmpeg failed')
+        return num_bytes
+
+    def frame_info(self, count):
+        """Numbers and times of the next count frames (call after readinto)
+
+        Returns:
+            Tuple of frame_nums, frame_times (lists)
+
+        Raises:
+            IOError: ffmpeg's frame timestamps ended early
+        """
+        if self.time_offset is None:
+            frame_nums = range(self._next_frame, self._next_frame + count * self.frame_skip,
+                               self.frame_skip)
+            self._next_frame += count * self.frame_skip
+            return frame_nums, [x / self.fps for x in frame_nums]
+        frame_nums, frame_times = [], []
+        for x in range(count):
+            item = self._times.get()
+            if item is None:
+                raise IOError("couldn't read the frame timestamps")
+            frame_num, pts, time_base = item
+            if frame_num is not None:
+                if self.stats is not None:
+                    self.stats.frames_decoded += frame_num + 1 - self.frames_decoded
+                self.frames_decoded = frame_num + 1
+                if self.time_offset:
+                    # Counted from the seek
+                    frame_num = None
+            frame_time = pts * time_base
+            if self.time_offset:
+                # The same tick a full pass has
+                offset = fractions.Fraction(self.time_offset)
+                frame_time = int(round(offset / time_base)) * time_base + frame_time
+            frame_time = float(frame_time)
+            if frame_num is None and self.frame_times is not None:
+                times, nums = self.frame_times
+                pos = bisect.bisect_left(times, frame_time)
+                # The nearest frame, the times can differ by rounding
+                if pos == len(times) or (pos and frame_time - times[pos - 1] < times[pos] - frame_time):
+                    pos -= 1
+                frame_num = nums[pos]
+            elif frame_num is None:
+                frame_num = int(round(frame_time * self.fps))
+            frame_nums.append(frame_num)
+            frame_times.append(frame_time)
+        return frame_nums, frame_times
+
+    def close(self):
+        """Kill ffmpeg (if it's still running)"""
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        if self.writer is not None:
+            self.writer.join()
+        if self.errors is None:
+            self._log_thread.join()
+            self.proc.stderr.close()
+        else:
+            self.errors.close()
+
+
+def _frame_range(fps, frame_skip=1, start_time=0., end_time=None, max_frames=None):
+    """Convert a time range to frame numbers
+
+    The frames (and their numbers) are then the same ones a full pass would
+    produce.
+
+    Returns:
+        Tuple of first_frame, end_frame, max_frames or None if the range is
+        empty, end_frame (exclusive) and max_frames are None if unlimited
+    """
+    first_frame = int(math.ceil(start_time * fps - 1e-6))
+    first_frame += -first_frame % frame_skip
+    end_frame = None
+    if end_time is not None:
+        end_frame = int(math.ceil(end_time * fps - 1e-6))
+        if end_frame <= first_frame:
+            return None
+        num_frames = (end_frame - first_frame + frame_skip - 1) // frame_skip
+        max_frames = min(max_frames or num_frames, num_frames)
+    return first_frame, end_frame, max_frames
+
+
+def _frame_args(file_name, info, frame_skip=1, pix_fmt='bgr24', start_time=0.,
+                end_time=None, max_frames=None, size=None, crop=None,
+                seek_time=None, threads=None, thread_type=None,
+                scene_threshold=None, keyframes=False, sample_fps=None,
+                timestamps=False):
+    """Build the ffmpeg arguments to write rawvideo frames to stdout
+
+    Args:
+        info: Output of probe
+        seek_time: Input seek (sec from the start of the file) used as is,
+            instead of start_time/end_time, frames are then numbered from 0
+            (for readers that know the frame times, see index)
+        timestamps: Log the frame timestamps (showinfo) to stderr, required
+            if ffmpeg drops frames (scene_threshold, keyframes, sample_fps).
+            Unless the decoder skips frames (keyframes), a first showinfo
+            also counts the frames before they're dropped
+        See frame_iter for the other arguments
+
+    Returns:
+        Tuple of args, fps, shape, first_frame, time_offset or None if the
+        time range is empty (see _FramePipe), time_offset is the input seek
+        (sec) the timestamps are relative to
     """
     assert frame_skip > 0 and isinstance(frame_skip, int)
+    assert pix_fmt in _PIX_FMTS
+    assert start_time >= 0
+    assert end_time is None or end_time > start_time
+    assert max_frames is None or (max_frames > 0 and isinstance(max_frames, int))
+    assert size is None or (len(size) == 2 and min(size) > 0)
+    assert crop is None or (len(crop) == 4 and min(crop[:2]) >= 0 and min(crop[2:]) > 0)
+    assert threads is None or (threads >= 0 and isinstance(threads, int))
+    assert thread_type in (None, 'frame', 'slice', 'frame+slice')
+    assert scene_threshold is None or (0 <= scene_threshold <= 1 and timestamps)
+    assert not keyframes or timestamps
+    assert sample_fps is None or (sample_fps > 0 and frame_skip == 1 and timestamps)
     frame_skip = int(max(frame_skip, 1))
-    if frozen:
-        assert 'ffmpegbin.tar' in os.listdir(os.curdir), \
-               "convert_video_ffmpeg was called with frozen=True, but \
-               ffmpegbin.tar wasn't found. Make sure freeze_ffmpeg() was \
-               passed to hadoopy.launch_frozen"
-
-        # Extract the ffmpeg binaries, if needed
-        ffmpegdir = os.path.join(os.curdir, 'ffmpegbin')
-        ffmpegcmd = os.path.join(ffmpegdir, 'ffmpeg')
-
-        if not os.path.exists(ffmpegdir):
-            os.makedirs(ffmpegdir)
-
-        if not os.path.exists(ffmpegcmd) or os.path.getmtime(ffmpegcmd) < \
-           os.path.getmtime('ffmpegbin.tar'):
-            f = tarfile.open('ffmpegbin.tar')
-            f.extractall(ffmpegdir)
-            f.close()
+    # The frame size is known up front, ffmpeg rotates by the display matrix
+    # before the filters
+    fps = float(info['fps'])
+    width, height = info['width'], info['height']
+    if info['rotation'] % 180:
+        width, height = height, width
+    if crop is not None:
+        width, height = crop[2:]
+    if size is not None:
+        width, height = size
+    if pix_fmt == 'yuv420p':
+        assert width % 2 == 0 and height % 2 == 0, 'yuv420p needs an even frame size'
+        # I420, the Y plane then the U and V planes (as rows of width)
+        shape = (height * 3 // 2, width)
+    else:
+        shape = (height, width, _PIX_FMT_CHANNELS[pix_fmt])
+        if shape[2] == 1:
+            shape = shape[:2]
+    args = ['-v', 'error', '-nostats']
+    if timestamps:
+        # showinfo logs at the info level, level tags set the errors apart
+        args = ['-v', 'level+info', '-nostats', '-hide_banner']
+    input_args = []
+    output_args = []
+    first_frame = 0
+    end_frame = None
+    start_filter = None
+    time_offset = 0.
+    # Decoder threading (input options), 0 lets ffmpeg pick
+    if threads is not None:
+        args += ['-threads', str(threads)]
+    if thread_type is not None:
+        args += ['-thread_type', thread_type]
+    if keyframes:
+        # The decoder skips the other frames, they're never decoded
+        args += ['-skip_frame', 'nokey']
+    if seek_time is not None:
+        assert not start_time and end_time is None
+        args += ['-ss', '%f' % seek_time]
+        time_offset = float('%f' % seek_time)
+    elif start_time or end_time is not None:
+        frame_range = _frame_range(fps, frame_skip, start_time, end_time, max_frames)
+        if frame_range is None:
+            return None
+        first_frame, end_frame, max_frames = frame_range
+        if first_frame and file_name == 'pipe:0':
+            # A pipe can't seek (demuxers can lose data trying), the frames
+            # before the start are dropped by time instead
+            start_filter = "select='gte(t\\,%f)'" % ((first_frame - .5) / fps)
+        elif first_frame:
+            # Seek half a frame early so rounding can't drop the first frame
+            seek_frame = first_frame - .5
+            if sample_fps is not None:
+                # The sample select compares each frame with the one before,
+                # so that one is decoded too and dropped after it
+                seek_frame = max(seek_frame - 1, 0)
+                start_filter = "select='gte(t\\,%f)'"
+            if seek_frame:
+                args += ['-ss', '%f' % (seek_frame / fps)]
+                time_offset = float('%f' % (seek_frame / fps))
+            if start_filter:
+                start_filter %= (first_frame - .5) / fps - time_offset
+        if end_frame is not None:
+            # -frames:v makes the end exact, -t (half a frame late) lets
+            # ffmpeg stop reading the input there.  When ffmpeg drops frames
+            # no output frame may reach it, it's an input option then
+            duration = ['-t', '%f' % ((end_frame + .5) / fps - time_offset)]
+            if timestamps:
+                input_args += duration
+            else:
+                output_args += duration
+    if max_frames is not None:
+        output_args += ['-frames:v', str(max_frames)]
+    # Dropped frames are never converted or piped, ffmpeg only outputs the
+    # frames that are yielded
+    filters = []
+    if timestamps and not keyframes:
+        # Counts the decoded frames, without a seek they're numbered by it
+        # (timestamps * fps is off on variable frame rate videos), a pipe
+        # isn't seeked so it's counted before start_filter
+        filters.append('showinfo@count=checksum=0')
+    if start_filter and sample_fps is None:
+        filters.append(start_filter)
+    if frame_skip > 1:
+        filters.append('select=not(mod(n\\,%d))' % frame_skip)
+    if sample_fps is not None:
+        # The first frame of each 1 / sample_fps interval of the video's
+        # time, by timestamp (variable frame rate videos are sampled
+        # regularly too, unlike with frame_skip), the frames before the
+        # start are compared with too.  After a seek t is
+        # relative to the seek rounded to a time base tick (TB), adding that
+        # tick back gives a full pass's time; half a tick more keeps float
+        # error from moving a frame on a sample boundary before it
+        shift = '(round(%f/TB)*TB+TB/2)' % time_offset
+        filters.append("select='isnan(prev_t)+gt(floor((t+%s)*%f)\\,floor((prev_t+%s)*%f))'"
+                       % (shift, sample_fps, shift, sample_fps))
+        if start_filter:
+            filters.append(start_filter)
+    # Crop and resize happen before the pixel format conversion, so only the
+    # reduced frames are converted and piped
+    if crop is not None:
+        filters.append('crop=%d:%d:%d:%d' % (crop[2], crop[3], crop[0], crop[1]))
+    if size is not None:
+        filters.append('scale=%d:%d' % tuple(size))
+    if scene_threshold is not None:
+        # The scene score (0 to 1) compares a frame with the one before,
+        # computed after crop/scale on the smaller frames
+        filters.append("select='eq(n\\,0)+gt(scene\\,%f)'" % scene_threshold)
+    if timestamps:
+        if end_frame is not None:
+            # -frames:v doesn't bound the time range when ffmpeg drops frames
+            filters.append("select='lt(t\\,%f)'" % ((end_frame - .5) / fps - time_offset))
+        filters.append('showinfo=checksum=0')
+    # ffmpeg writes headerless frames of a fixed size in the requested format
+    args += input_args + ['-i', file_name] + output_args
+    if filters:
+        args += ['-vf', ','.join(filters)]
+    args += ['-vsync', 'passthrough', '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-']
+    return args, fps, shape, first_frame, time_offset
 
-        # Launch ffmpeg with subprocess
-        args = ('-i %s -f image2pipe -vcodec ppm -' % file_name).split()
-        proc = subprocess.Popen([ffmpegcmd] + args,
-                            stdout=subprocess.PIPE,
-                            stdin=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            env={'LD_LIBRARY_PATH': ffmpegdir},
-                            close_fds=True, shell=False)
+
+def _frame_pipe(file_name, frozen=False, frame_skip=1, pix_fmt='bgr24',
+                start_time=0., end_time=None, max_frames=None, size=None,
+                crop=None, seek_time=None, threads=None, thread_type=None,
+                backend=None, scene_threshold=None, keyframes=False,
+                sample_fps=None):
+    """Launch ffmpeg writing rawvideo frames to its stdout (or open the
+    video with another backend, see backends)
+
+    Args:
+        See _frame_args and frame_iter
+
+    Returns:
+        _FramePipe or backend equivalent (the caller must close it) or None
+        if the time range is empty
+
+    Raises:
+        IOError: Problem reading from ffmpeg
+    """
+    # Imported here, these modules import this one
+    from threads import decoder_threads
+    from backends import choose_backend
+    if threads == 'auto':
+        threads, auto_type = decoder_threads(frozen=frozen)
+        thread_type = thread_type or auto_type
+    choose_backend(backend, frozen)
+    # ffmpeg drops frames, they're numbered from its timestamps
+    drops = scene_threshold is not None or keyframes or sample_fps is not None
+    data = None
+    if _is_data(file_name):
+        data = _rewindable(file_name)
+        file_name = 'pipe:0'
+    params = _frame_args(file_name, probe(file_name if data is None else data, frozen),
+                         frame_skip, pix_fmt, start_time, end_time, max_frames,
+                         size, crop, seek_time, threads, thread_type,
+                         scene_threshold, keyframes, sample_fps, timestamps=drops)
+    if params is None:
+        return None
+    args, fps, shape, first_frame, time_offset = params
+    frame_times = None
+    if not drops:
+        time_offset = None
+        # Errors go to a temp file, so ffmpeg never blocks on a full stderr pipe
+        errors = tempfile.TemporaryFile()
     else:
-        cmd = 'ffmpeg -i %s -f image2pipe -vcodec ppm -' % file_name
-        proc = subprocess.Popen(cmd,
-                            stdout=subprocess.PIPE,
-                            stdin=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            close_fds=True, shell=True)
+        # The timestamps are read from stderr as the frames arrive
+        errors = subprocess.PIPE
+        if (keyframes or time_offset) and data is None:
+            # Without ffmpeg's count the frames are found in the packet
+            # times of the sidecar index, read here only for a whole video
+            # (imported here, index imports this module)
+            from index import _cached_index, _read_packets
+            index = _cached_index(file_name)
+            if index is not None:
+                times, nums = index['times'], index['keyframes']
+            elif not time_offset:
+                times, nums = _read_packets(file_name, frozen)
+            if index is not None or not time_offset:
+                if keyframes:
+                    frame_times = [times[x] for x in nums], nums
+                else:
+                    frame_times = times, range(len(times))
+    proc = _ffmpeg_popen(args, frozen, stderr=errors)
+    writer = None if data is None else _feed(proc.stdin, data)
+    return _FramePipe(proc, None if drops else errors, fps, shape, first_frame,
+                      frame_skip, writer, time_offset, frame_times,
+                      drops and not keyframes)
+
 
-    # Get the FPS from the ffmpeg stderr dump
-    fps = _read_fps(proc.stderr)
-    proc.stderr.close()
-    # Read and yield PPMs from the ffmpeg pipe
+def _prefetch(iterator, depth):
+    """Run an iterator in a background thread, buffering up to depth items
+
+    The thread is stopped and the iterator closed when this generator is
+    closed.  Exceptions raised by the iterator are re-raised here.
+    """
+    items = Queue.Queue(depth)
+    stop = threading.Event()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _run():
+        try:
+            for item in iterator:
+                if not _put((True, item)):
+                    break
+            else:
+                _put((False, None))
+        except:
+            _put((False, sys.exc_info()))
+        finally:
+            iterator.close()
+
+    thread = threading.Thread(target=_run)
+    thread.daemon = True
+    thread.start()
     try:
-        frame_num = -1
         while True:
-            frame = _read_ppm(proc.stdout)
-            frame_num += 1
-            if frame is None:
+            ok, item = items.get()
+            if ok:
+                yield item
+            elif item is None:
                 break
-            if frame_num % frame_skip == 0:
-                yield frame_num, frame_num / fps, frame
+            else:
+                raise item[0], item[1], item[2]
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _track(items, stats, count):
+    """Time the consumer of an iterator and the waits for its items
+
+    Args:
+        items: Iterator (closed when done)
+        stats: FrameStats
+        count: Function returning the number of frames in an item
+    """
+    try:
+        while True:
+            start = time.time()
+            try:
+                item = next(items)
+            except StopIteration:
+                break
+            resume = time.time()
+            stats.wait_time += resume - start
+            stats.frames_yielded += count(item)
+            yield item
+            stats.consumer_time += time.time() - resume
+            stats._tick()
+    finally:
+        items.close()
+        stats._tick(True)
+
+
+def _read_frames(pipe, num_buffers=None):
+    """Read frames from a _FramePipe, it's closed when done
+
+    Args:
+        pipe: _FramePipe
+        num_buffers: If not None, frames are read into a ring of this many
+            arrays instead of new ones
+
+    Yields:
+        Tuple of frame_num, frame_time, frame (see frame_iter)
+    """
+    shape = pipe.shape
+    try:
+        ring = [np.empty(shape, dtype=np.uint8) for x in range(num_buffers or 0)]
+        while True:
+            if ring:
+                frame = ring[0]
+                ring.append(ring.pop(0))
+            else:
+                frame = np.empty(shape, dtype=np.uint8)
+            if pipe.readinto(frame.reshape(-1)) != frame.nbytes:
+                break
+            frame_nums, frame_times = pipe.frame_info(1)
+            yield frame_nums[0], frame_times[0], frame
     finally:
         # Kill the ffmpeg process early if the generator is destroyed
-        proc.kill()
-        proc.wait()
+        pipe.close()
+
+
+def _read_batches(pipe, batch_size, num_buffers):
+    """Read batches of frames from a _FramePipe, it's closed when done
+
+    Args:
+        pipe: _FramePipe
+        batch_size: Number of frames per batch
+        num_buffers: Number of batch arrays in the ring
+
+    Yields:
+        Tuple of frames, frame_nums, frame_times (see batch_iter)
+    """
+    shape = pipe.shape
+    try:
+        ring = [np.empty((batch_size,) + shape, dtype=np.uint8)
+                for x in range(num_buffers)]
+        frame_bytes = ring[0][0].nbytes
+        batch_num = 0
+        while True:
+            batch = ring[batch_num % num_buffers]
+            batch_num += 1
+            # Only the last batch can be partial (ffmpeg closed the pipe)
+            count = pipe.readinto(batch.reshape(-1)) // frame_bytes
+            if not count:
+                break
+            frame_nums, frame_times = pipe.frame_info(count)
+            yield batch[:count], np.array(frame_nums), np.array(frame_times)
+            if count < batch_size:
+                break
+    finally:
+        # Kill the ffmpeg process early if the generator is destroyed
+        pipe.close()
+
+
+def _scene_filter(frames, threshold, max_frames=None, width=64):
+    """Drop the frames that are nearly the same as the last one kept
+
+    Frames are compared by the mean absolute difference (0 to 1) of copies
+    downsampled to about width columns, the first frame is always kept.
+
+    Args:
+        frames: Iterator of frame_num, frame_time, frame (closed when done)
+        threshold: Difference above which a frame is kept
+        max_frames: Maximum number of frames to keep (default is all)
+        width: Columns of the downsampled copies
+    """
+    last = None
+    count = 0
+    try:
+        for item in frames:
+            if count == max_frames:
+                break
+            frame = item[2]
+            step = max(frame.shape[1] // width, 1)
+            thumb = frame[::step, ::step].astype(np.int16)
+            if last is None or np.abs(thumb - last).mean() / 255. > threshold:
+                # A copy, the frame can be a reused buffer
+                last = thumb
+                count += 1
+                yield item
+    finally:
+        frames.close()
+
+
+def yuv_planes(frame):
+    """Split yuv420p (I420) frames into their Y, U and V planes, without
+    copying
+
+    Args:
+        frame: Array of shape (..., height * 3 / 2, width), e.g., a frame or
+            batch of batch_iter (or pool_iter, VideoReader) with
+            pix_fmt='yuv420p'
+
+    Returns:
+        Tuple of views y (..., height, width), u and v
+        (..., height / 2, width / 2)
+    """
+    height, width = frame.shape[-2] * 2 // 3, frame.shape[-1]
+    chroma = frame[..., height:, :].reshape(frame.shape[:-2] + (2, height // 2, width // 2))
+    return frame[..., :height, :], chroma[..., 0, :, :], chroma[..., 1, :, :]
+
+
+def frame_iter(file_name, frozen=False, frame_skip=1, pix_fmt='bgr24',
+               reuse_buffer=False, start_time=0., end_time=None,
+               max_frames=None, size=None, crop=None, prefetch=0, stats=None,
+               threads=None, thread_type=None, backend=None,
+               scene_threshold=None, scene_method='ffmpeg', keyframes=False,
+               sample_fps=None):
+    """
+    Args:
+        filename: video file to open, or the video's data as a string,
+            buffer (e.g., bytearray or memoryview) or file object, which
+            is fed to ffmpeg's stdin without a temp file.  Data must be in
+            a format that can be read from a pipe (e.g., mkv, ts or an mp4
+            with the moov atom first), a file object that isn't seekable is
+            read into memory.
+        frozen: use the ffmpeg binary extracted from  ./ffmpegbin.tar
+            (see vidfeat.freeze_ffmpeg)
+        frame_skip: How many frames to increment by (default 1 produces all frames,
+            2 skips every other one).  Skipped frames are dropped inside
+            ffmpeg and never sent through the pipe.
+        pix_fmt: Pixel format ffmpeg converts to, one of 'bgr24' (default),
+            'rgb24', 'gray' (frames are then 2D) or 'yuv420p'.  With yuv420p
+            (most videos' native format, no conversion and half of bgr24's
+            bytes) frames are tuples of Y (height, width), U and V
+            (height / 2, width / 2) views of one buffer (see yuv_planes, the
+            size must be even)
+        reuse_buffer: If True, frames are read into a few reused arrays, so
+            the yielded frame is only valid until the next iteration (copy it
+            to keep it).  Avoids a per-frame allocation.
+        start_time: Time (sec) of the first frame to produce, ffmpeg seeks
+            to it directly so the frames before it are not decoded
+        end_time: Time (sec) to stop at (exclusive), default is the end of
+            the video
+        max_frames: Maximum number of frames to produce (default is all)
+        size: (width, height) to resize frames to inside ffmpeg (after crop)
+        crop: (x, y, width, height) region of the source frame to keep
+        prefetch: If > 0, frames are read in a background thread into a queue
+            of this many frames, so decoding overlaps with the consumer
+        stats: FrameStats to record timings and counters in
+        threads: Number of ffmpeg decoder threads (default is ffmpeg's, one
+            per cpu), 'auto' uses the tuned setting for one video at a time
+            (see decoder_threads, use it directly when several videos are
+            decoded at once)
+        thread_type: Decoder threading 'frame', 'slice' or 'frame+slice'
+            (default is ffmpeg's, or the tuned one with threads='auto')
+        backend: 'ffmpeg' (ffmpeg program and a pipe), the default and only
+            one (see backends)
+        scene_threshold: If not None (0 to 1), only the frames that differ
+            from the one before by more than this are produced (the first
+            frame always is), e.g., .1 keeps the scene changes of mostly
+            static footage
+        scene_method: How frames are compared with scene_threshold
+            'ffmpeg': ffmpeg's scene score (select filter), dropped frames
+                are never piped.  Compares each frame with the previous
+                decoded frame (after crop and size), so a slow drift can
+                be dropped entirely
+            'numpy': Mean absolute difference (0 to 1) of a downsampled copy
+                of the frame with the last produced frame, all the frames are
+                piped (see frame_skip and size to reduce them)
+        keyframes: If True, only the keyframes are produced, the decoder
+            skips the other frames (much faster than a full decode on long
+            GOPs, e.g., for thumbnails).  frame_skip then counts keyframes
+        sample_fps: If not None, about this many frames per second are
+            produced, the first of each 1 / sample_fps interval of the
+            video's time (selected in ffmpeg by timestamp, so variable frame
+            rate videos are sampled regularly).  Can't be used with
+            frame_skip
+
+    Yields:
+        Tuple of frame_num, frame_time, frame where
+        frame_num: Current frame number (starts at 0, relative to the start
+            of the video even when start_time is used).  Frames ffmpeg
+            drops are counted, or found in the file's packet times with
+            keyframes (the whole video's) or start_time (only if the video
+            has a sidecar index, see build_index).  Else it's frame_time *
+            fps rounded, approximate on variable frame rate videos
+        frame_time: Current video time (starts at 0., uses the FPS from
+            probe), the frame's timestamp with scene_threshold (ffmpeg),
+            keyframes or sample_fps
+        frame: Numpy array (bgr by default, see pix_fmt) of shape
+            (height, width, 3) or (height, width) for gray
+
+    Raises:
+        IOError: Problem reading from ffmpeg
+    """
+    assert prefetch >= 0 and isinstance(prefetch, int)
+    assert scene_threshold is None or 0 <= scene_threshold <= 1
+    assert scene_method in ('ffmpeg', 'numpy')
+    if stats is not None:
+        stats._started()
+    numpy_scene = scene_threshold is not None and scene_method == 'numpy'
+    # max_frames counts the produced frames, numpy drops them after the pipe
+    pipe = _frame_pipe(file_name, frozen, frame_skip, pix_fmt, start_time,
+                       end_time, None if numpy_scene else max_frames, size, crop,
+                       threads=threads, thread_type=thread_type, backend=backend,
+                       scene_threshold=None if numpy_scene else scene_threshold,
+                       keyframes=keyframes, sample_fps=sample_fps)
+    if pipe is None:
+        return
+    pipe.stats = stats
+    # The reader thread can be up to prefetch + 1 frames ahead of the consumer
+    num_buffers = prefetch + 1 + (prefetch > 0) if reuse_buffer else None
+    frames = _read_frames(pipe, num_buffers)
+    if numpy_scene:
+        frames = _scene_filter(frames, scene_threshold, max_frames)
+    if prefetch:
+        frames = _prefetch(frames, prefetch)
+    if stats is not None:
+        frames = _track(frames, stats, lambda x: 1)
+    try:
+        for frame in frames:
+            if pix_fmt == 'yuv420p':
+                frame = frame[:2] + (yuv_planes(frame[2]),)
+            yield frame
+    finally:
+        frames.close()
+
+
+def batch_iter(file_name, batch_size=32, frozen=False, frame_skip=1,
+               pix_fmt='bgr24', start_time=0., end_time=None, max_frames=None,
+               size=None, crop=None, prefetch=0, num_buffers=None, stats=None,
+               threads=None, thread_type=None, backend=None):
+    """Like frame_iter but yields batches of consecutive frames
+
+    Each batch is read from the ffmpeg pipe directly into one contiguous
+    array.  The arrays come from a ring of num_buffers preallocated batches,
+    so a yielded batch is overwritten num_buffers - prefetch - 1 batches
+    later (copy it to keep it longer).
+
+    Args:
+        file_name: video file to open or its data (see frame_iter)
+        batch_size: Number of frames per batch (the last one may be smaller)
+        prefetch: If > 0, batches are read in a background thread into a
+            queue of this many batches
+        num_buffers: Number of batch arrays in the ring, at least
+            prefetch + 2 (default)
+        See frame_iter for the other arguments
+
+    Yields:
+        Tuple of frames, frame_nums, frame_times where
+        frames: Numpy array (N, height, width, 3), (N, height, width) for
+            gray or (N, height * 3 / 2, width) for yuv420p (see yuv_planes)
+        frame_nums: Numpy array (N,) of frame numbers
+        frame_times: Numpy array (N,) of frame times (sec)
+
+    Raises:
+        IOError: Problem reading from ffmpeg
+    """
+    assert batch_size > 0 and isinstance(batch_size, int)
+    assert prefetch >= 0 and isinstance(prefetch, int)
+    if num_buffers is None:
+        num_buffers = prefetch + 2
+    assert num_buffers >= prefetch + 2 and isinstance(num_buffers, int)
+    if stats is not None:
+        stats._started()
+    pipe = _frame_pipe(file_name, frozen, frame_skip, pix_fmt, start_time,
+                       end_time, max_frames, size, crop, threads=threads,
+                       thread_type=thread_type, backend=backend)
+    if pipe is None:
+        return
+    pipe.stats = stats
+    batches = _read_batches(pipe, batch_size, num_buffers)
+    if prefetch:
+        batches = _prefetch(batches, prefetch)
+    if stats is not None:
+        batches = _track(batches, stats, lambda x: len(x[0]))
+    try:
+        for batch in batches:
+            yield batch
+    finally:
+        batches.close()
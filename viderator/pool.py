@@ -0,0 +1,197 @@
+import multiprocessing
+import collections
+import mmap
+import time
+import numpy as np
+from main import _frame_pipe, _track
+from threads import decoder_threads
+
+# The frame_iter options the workers support (they decode with _frame_pipe)
+_WORKER_OPTIONS = ('frozen', 'frame_skip', 'pix_fmt', 'start_time', 'end_time',
+                   'max_frames', 'size', 'crop', 'threads', 'thread_type',
+                   'backend', 'scene_threshold', 'scene_method', 'keyframes',
+                   'sample_fps')
+
+
+def _worker_kw(kw):
+    """Check the frame_iter options given to pool_iter
+
+    Returns:
+        The options to pass to _frame_pipe
+
+    Raises:
+        ValueError: An option the workers don't support
+    """
+    unsupported = sorted(set(kw) - set(_WORKER_OPTIONS))
+    if unsupported:
+        raise ValueError('Unsupported option(s) %s (one of %s)'
+                         % (', '.join(unsupported), ', '.join(_WORKER_OPTIONS)))
+    kw = dict(kw)
+    if kw.pop('scene_method', 'ffmpeg') != 'ffmpeg':
+        raise ValueError("Only scene_method='ffmpeg' is supported")
+    return kw
+
+
+def _worker(worker_num, tasks, results, free_slots, buf, slot_bytes):
+    """Decode videos from the task queue into shared memory slots
+
+    Every frame is read from the ffmpeg pipe directly into a free slot of
+    buf and only its location is sent to the parent.
+    """
+    frames = np.frombuffer(buf, dtype=np.uint8)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        video_id, file_name, kw = task
+        try:
+            pipe = _frame_pipe(file_name, **kw)
+            if pipe is not None:
+                shape = pipe.shape
+                try:
+                    frame_bytes = int(np.prod(shape))
+                    if frame_bytes > slot_bytes:
+                        raise IOError('Frame shape %s is larger than max_frame_bytes (%d)'
+                                      % (shape, slot_bytes))
+                    while True:
+                        slot = free_slots.get()
+                        offset = slot * slot_bytes
+                        start = time.time()
+                        decoded = pipe.frames_decoded
+                        if pipe.readinto(frames[offset:offset + frame_bytes]) != frame_bytes:
+                            free_slots.put(slot)
+                            break
+                        frame_nums, frame_times = pipe.frame_info(1)
+                        results.put(('frame', video_id, worker_num, frame_nums[0],
+                                     frame_times[0], slot, shape, time.time() - start,
+                                     pipe.frames_decoded - decoded))
+                finally:
+                    pipe.close()
+        except Exception, e:
+            results.put(('error', video_id, e))
+        else:
+            results.put(('done', video_id))
+
+
+def pool_iter(file_names, num_workers=None, ordered=False, num_buffers=4,
+              max_frame_bytes=1920 * 1080 * 3, stats=None, **kw):
+    """Decode many videos in parallel, one ffmpeg per worker process
+
+    Frames are passed from the workers through shared memory (a block of
+    num_buffers frame slots per worker) instead of being pickled.  A yielded
+    frame is a view of a slot and is only valid until the next iteration
+    (copy it to keep it).
+
+    Args:
+        file_names: List of video files
+        num_workers: Number of videos decoded at once (default is the number
+            of cpus)
+        ordered: If True, all frames of a video are yielded before the frames
+            of the next one (in file_names order), else frames are yielded as
+            they arrive (still in order within each video)
+        num_buffers: Number of frame slots per worker
+        max_frame_bytes: Size of a frame slot, frames (after size/crop/pix_fmt)
+            must fit in it
+        stats: FrameStats to record timings and counters in (read_time is
+            summed over the workers)
+        **kw: frame_iter options of the workers (frozen, frame_skip,
+            pix_fmt, start_time, end_time, max_frames, size, crop, threads,
+            thread_type, backend, scene_threshold, keyframes, sample_fps),
+            threads='auto' is tuned for num_workers videos at once
+
+    Yields:
+        Tuple of video_id, frame_num, frame_time, frame where
+        video_id: Index of the video in file_names
+        See frame_iter for the rest
+
+    Raises:
+        IOError: Problem reading from ffmpeg (for any of the videos)
+        ValueError: An option the workers don't support (e.g., prefetch or
+            scene_method='numpy')
+    """
+    kw = _worker_kw(kw)
+    if stats is not None:
+        stats._started()
+    frames = _pool_iter([(file_name, kw) for file_name in file_names],
+                        num_workers, ordered, num_buffers, max_frame_bytes, stats)
+    if stats is not None:
+        frames = _track(frames, stats, lambda x: 1)
+    return frames
+
+
+def _pool_iter(tasks, num_workers=None, ordered=False, num_buffers=4,
+               max_frame_bytes=1920 * 1080 * 3, stats=None):
+    """Decode (file_name, kw) tasks in parallel, see pool_iter
+
+    Frames read by the workers are recorded in stats (if not None).
+
+    Yields:
+        Tuple of task_id, frame_num, frame_time, frame (task_id is the index
+        in tasks)
+    """
+    assert num_buffers > 0 and isinstance(num_buffers, int)
+    if not tasks:
+        return
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    num_workers = max(min(num_workers, len(tasks)), 1)
+    task_queue = multiprocessing.Queue()
+    for task_id, (file_name, kw) in enumerate(tasks):
+        if kw.get('threads') == 'auto':
+            # Tuned for num_workers ffmpegs running side by side
+            threads, thread_type = decoder_threads(num_workers, kw.get('frozen', False))
+            kw = dict(kw, threads=threads, thread_type=kw.get('thread_type') or thread_type)
+        task_queue.put((task_id, file_name, kw))
+    for x in range(num_workers):
+        task_queue.put(None)
+    results = multiprocessing.Queue()
+    workers = []
+    for worker_num in range(num_workers):
+        # Anonymous shared mmap, inherited by the worker when it forks
+        buf = mmap.mmap(-1, num_buffers * max_frame_bytes)
+        free_slots = multiprocessing.Queue()
+        for slot in range(num_buffers):
+            free_slots.put(slot)
+        proc = multiprocessing.Process(target=_worker,
+                                       args=(worker_num, task_queue, results,
+                                             free_slots, buf, max_frame_bytes))
+        proc.daemon = True
+        proc.start()
+        workers.append((proc, buf, free_slots))
+    # Frames of later videos are held (with their slots) until their turn
+    pending = collections.defaultdict(collections.deque)
+    next_video = 0
+    num_done = 0
+    try:
+        while num_done < len(tasks):
+            if ordered:
+                while not pending[next_video]:
+                    result = results.get()
+                    pending[result[1]].append(result)
+                result = pending[next_video].popleft()
+            else:
+                result = results.get()
+            if result[0] == 'error':
+                raise result[2]
+            if result[0] == 'done':
+                num_done += 1
+                if ordered:
+                    del pending[next_video]
+                    next_video += 1
+                continue
+            video_id, worker_num, frame_num, frame_time, slot, shape, read_time, decoded = result[1:]
+            proc, buf, free_slots = workers[worker_num]
+            frame = np.frombuffer(buf, dtype=np.uint8, count=int(np.prod(shape)),
+                                  offset=slot * max_frame_bytes).reshape(shape)
+            if stats is not None:
+                stats._read(frame.nbytes, 1, decoded, read_time)
+            yield video_id, frame_num, frame_time, frame
+            # The consumer is done with the frame, give its slot back
+            free_slots.put(slot)
+        for proc, buf, free_slots in workers:
+            proc.join()
+    finally:
+        for proc, buf, free_slots in workers:
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
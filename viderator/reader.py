@@ -0,0 +1,176 @@
+import bisect
+import collections
+from main import _frame_pipe, _read_frames
+from index import load_index
+
+
+class VideoReader(object):
+    """Random access to the frames of a video
+
+    Uses the video's keyframe index (see build_index, it's built on first
+    use and kept in a sidecar file).  A frame is decoded by seeking to the
+    keyframe before it, so only the frames in between are decoded.
+
+    With cache_bytes > 0 decoded frames are kept in an LRU cache of that
+    many bytes, and a miss decodes (and caches) the whole GOP around the
+    frame so neighboring frames are hits.  Cached frames are shared, they
+    are returned read-only.  hits and misses count the frames requested.
+
+    Example:
+        reader = VideoReader('video.mp4', size=(224, 224))
+        frame = reader.get_frame(90000)
+    """
+
+    def __init__(self, file_name, frozen=False, pix_fmt='bgr24', size=None,
+                 crop=None, index_path=None, cache_bytes=0):
+        """
+        Args:
+            file_name: video file to open
+            index_path: Sidecar index file (default is file_name + '.vidx')
+            cache_bytes: Memory budget of the decoded frame cache (0 disables
+                it)
+            See frame_iter for the other arguments
+
+        Raises:
+            IOError: Problem reading from ffprobe
+        """
+        self.file_name = file_name
+        self.frozen = frozen
+        self._options = {'pix_fmt': pix_fmt, 'size': size, 'crop': crop}
+        self.index = load_index(file_name, frozen, index_path)
+        self.fps = float(self.index['fps'])
+        self.num_frames = len(self.index['times'])
+        # Frame times relative to the first frame (frame_iter's frame_time)
+        self.frame_times = [x - self.index['times'][0] for x in self.index['times']]
+        self.cache_bytes = cache_bytes
+        self._cache = collections.OrderedDict()
+        self._cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.num_frames
+
+    def _keyframe(self, frame_num):
+        """Number of the keyframe at or before frame_num"""
+        keyframes = self.index['keyframes']
+        pos = bisect.bisect_right(keyframes, frame_num) - 1
+        return keyframes[pos] if pos >= 0 else 0
+
+    def _next_keyframe(self, frame_num):
+        """Number of the keyframe after frame_num (num_frames if none)"""
+        keyframes = self.index['keyframes']
+        pos = bisect.bisect_right(keyframes, frame_num)
+        return keyframes[pos] if pos < len(keyframes) else self.num_frames
+
+    def _decode(self, frame_num, count):
+        """Decode count frames starting at frame_num
+
+        Yields:
+            Tuple of frame_num, frame
+        """
+        times = self.index['times']
+        # Seek between the previous frame and this one, ffmpeg goes to the
+        # keyframe before and drops the frames before the seek time
+        seek_time = (times[frame_num - 1] + times[frame_num]) / 2 if frame_num else None
+        pipe = _frame_pipe(self.file_name, self.frozen, max_frames=count,
+                           seek_time=seek_time, **self._options)
+        for offset, (x, y, frame) in enumerate(_read_frames(pipe)):
+            yield frame_num + offset, frame
+
+    def _cache_put(self, frame_num, frame):
+        if frame.nbytes > self.cache_bytes or frame_num in self._cache:
+            return
+        frame.flags.writeable = False
+        self._cache[frame_num] = frame
+        self._cached_bytes += frame.nbytes
+        while self._cached_bytes > self.cache_bytes:
+            self._cached_bytes -= self._cache.popitem(last=False)[1].nbytes
+
+    def cache_info(self):
+        """Cache statistics
+
+        Returns:
+            Dict with hits, misses, frames (cached), bytes (cached) and
+            max_bytes
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'frames': len(self._cache), 'bytes': self._cached_bytes,
+                'max_bytes': self.cache_bytes}
+
+    def clear_cache(self):
+        self._cache.clear()
+        self._cached_bytes = 0
+
+    def frame_num_at(self, frame_time):
+        """Number of the frame shown at frame_time (sec from the first frame)"""
+        return max(bisect.bisect_right(self.frame_times, frame_time + 1e-6) - 1, 0)
+
+    def get_frames(self, frame_nums):
+        """Decode several frames, frames in the same GOP share one decode
+
+        Args:
+            frame_nums: Iterable of frame numbers (any order, repeats are ok)
+
+        Returns:
+            List of frames (numpy arrays, see frame_iter) in frame_nums order
+
+        Raises:
+            IndexError: Frame number out of range
+            IOError: Problem reading from ffmpeg
+        """
+        frame_nums = list(frame_nums)
+        for frame_num in frame_nums:
+            if not 0 <= frame_num < self.num_frames:
+                raise IndexError('Frame %d not in [0, %d)' % (frame_num, self.num_frames))
+        frames = {}
+        wanted = []
+        for frame_num in sorted(set(frame_nums)):
+            if frame_num in self._cache:
+                # Most recently used at the end
+                frames[frame_num] = self._cache.pop(frame_num)
+                self._cache[frame_num] = frames[frame_num]
+                self.hits += 1
+            else:
+                wanted.append(frame_num)
+                self.misses += 1
+        # Ranges of frames to decode as [start, stop)
+        ranges = []
+        pos = 0
+        while pos < len(wanted):
+            # Keep decoding forward while the next frame isn't past another
+            # keyframe (seeking wouldn't skip any decoding)
+            end = pos
+            while end + 1 < len(wanted) and self._keyframe(wanted[end + 1]) <= wanted[end]:
+                end += 1
+            if self.cache_bytes:
+                # Read ahead to whole GOPs, the decoder goes through the
+                # frames from the keyframe anyway
+                start = self._keyframe(wanted[pos])
+                stop = self._next_keyframe(wanted[end])
+            else:
+                start, stop = wanted[pos], wanted[end] + 1
+            if ranges and ranges[-1][1] >= start:
+                ranges[-1][1] = max(ranges[-1][1], stop)
+            else:
+                ranges.append([start, stop])
+            pos = end + 1
+        wanted = set(wanted)
+        for start, stop in ranges:
+            for frame_num, frame in self._decode(start, stop - start):
+                if frame_num in wanted:
+                    frames[frame_num] = frame
+                if self.cache_bytes:
+                    self._cache_put(frame_num, frame)
+        try:
+            return [frames[x] for x in frame_nums]
+        except KeyError, e:
+            raise IOError("couldn't decode frame %d" % e.args[0])
+
+    def get_frame(self, frame_num):
+        """Decode one frame (see get_frames)"""
+        return self.get_frames([frame_num])[0]
+
+    def get_frame_at(self, frame_time):
+        """Decode the frame shown at frame_time (sec from the first frame)"""
+        return self.get_frame(self.frame_num_at(frame_time))
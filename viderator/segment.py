@@ -0,0 +1,96 @@
+import math
+import multiprocessing
+from main import probe, yuv_planes, _track
+from index import _read_packets
+from pool import _pool_iter, _worker_kw
+
+
+def segment_iter(file_name, num_segments=None, frozen=False, frame_skip=1,
+                 start_time=0., end_time=None, max_frames=None,
+                 num_workers=None, num_buffers=4,
+                 max_frame_bytes=1920 * 1080 * 3, stats=None, **kw):
+    """Decode one video with several ffmpegs in parallel, one per time segment
+
+    The video is split at keyframes (so no ffmpeg decodes frames it doesn't
+    output) and each segment is decoded with input seeking by a pool_iter
+    worker.  Segment boundaries are whole frame numbers, so the merged
+    output is the same as frame_iter's: continuous, ordered and with no
+    duplicated or missing frames.  A yielded frame is only valid until the
+    next iteration (copy it to keep it).
+
+    Args:
+        file_name: video file to open
+        num_segments: Number of segments (default is num_workers), fewer are
+            used if there aren't enough keyframes
+        num_workers: Number of segments decoded at once (default is the
+            number of cpus)
+        num_buffers: Number of frame slots per worker (see pool_iter)
+        max_frame_bytes: Size of a frame slot (see pool_iter)
+        stats: FrameStats to record timings and counters in (see pool_iter)
+        **kw: frame_iter options supported by pool_iter, except
+            scene_threshold and sample_fps (each segment would keep its
+            first frame)
+        See frame_iter for the other arguments
+
+    Yields:
+        Tuple of frame_num, frame_time, frame (see frame_iter)
+
+    Raises:
+        IOError: Problem reading from ffmpeg
+        ValueError: An option that isn't supported
+    """
+    assert frame_skip > 0 and isinstance(frame_skip, int)
+    assert start_time >= 0
+    assert end_time is None or end_time > start_time
+    assert max_frames is None or (max_frames > 0 and isinstance(max_frames, int))
+    kw = _worker_kw(kw)
+    for key in ('scene_threshold', 'sample_fps'):
+        if kw.get(key) is not None:
+            raise ValueError("segment_iter doesn't support %s" % key)
+    if stats is not None:
+        stats._started()
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    if num_segments is None:
+        num_segments = num_workers
+    fps = float(probe(file_name, frozen)['fps'])
+    times, keyframes = _read_packets(file_name, frozen)
+    # Everything is in frame numbers (see frame_iter's start_time/end_time)
+    first_frame = int(math.ceil(start_time * fps - 1e-6))
+    last_frame = len(times)
+    if end_time is not None:
+        last_frame = min(last_frame, int(math.ceil(end_time * fps - 1e-6)))
+    if last_frame <= first_frame:
+        return
+    keyframes = [x for x in keyframes if first_frame < x < last_frame]
+    # Split at the keyframes closest to evenly spaced frames
+    bounds = [first_frame]
+    for segment_num in range(1, num_segments):
+        target = first_frame + (last_frame - first_frame) * segment_num / num_segments
+        if keyframes:
+            bound = min(keyframes, key=lambda x: abs(x - target))
+            if bound > bounds[-1]:
+                bounds.append(bound)
+    bounds.append(None if end_time is None else last_frame)
+    # Frame numbers are converted back to times exactly on a frame, the
+    # last segment runs to end_time (or the end of the video)
+    tasks = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        segment_kw = dict(kw, frozen=frozen, frame_skip=frame_skip,
+                          start_time=start / fps)
+        if end is not None:
+            segment_kw['end_time'] = end / fps
+        tasks.append((file_name, segment_kw))
+    frames = _pool_iter(tasks, num_workers, True, num_buffers, max_frame_bytes, stats)
+    if stats is not None:
+        frames = _track(frames, stats, lambda x: 1)
+    yuv = kw.get('pix_fmt') == 'yuv420p'
+    num_frames = 0
+    try:
+        for segment_num, frame_num, frame_time, frame in frames:
+            yield frame_num, frame_time, yuv_planes(frame) if yuv else frame
+            num_frames += 1
+            if num_frames == max_frames:
+                break
+    finally:
+        frames.close()
@@ -0,0 +1,159 @@
+import multiprocessing
+import threading
+import tempfile
+import shutil
+import json
+import time
+import os
+from main import _ffmpeg_popen
+
+# Tuned settings of this node, keyed by ffmpeg version, cpus and concurrency
+CACHE_PATH = os.path.expanduser('~/.viderator_threads.json')
+_tuned = {}
+_tuned_lock = threading.Lock()
+# First line of ffmpeg -version, keyed by frozen (the binary doesn't change)
+_versions = {}
+
+
+def _ffmpeg_version(frozen=False):
+    frozen = bool(frozen)
+    if frozen not in _versions:
+        proc = _ffmpeg_popen(['-version'], frozen)
+        out = proc.communicate()[0]
+        _versions[frozen] = out.splitlines()[0] if out else 'unknown'
+    return _versions[frozen]
+
+
+def _candidates(num_cpus, concurrency):
+    """(threads, thread_type) settings worth trying
+
+    Around the fair share of cpus per ffmpeg: fewer threads avoid
+    oversubscribing, more fill the cpus when the decoders stall.
+    """
+    share = max(num_cpus // concurrency, 1)
+    counts = set([1, share, min(2 * share, num_cpus)])
+    counts.update(2 ** x for x in range(1, 6) if 2 ** x < share)
+    out = []
+    for threads in sorted(counts):
+        for thread_type in ('frame', 'slice') if threads > 1 else ('frame',):
+            out.append((threads, thread_type))
+    return out
+
+
+def _make_video(path, duration, frozen=False):
+    """Generate the calibration video (1080p, h264 if available)"""
+    for codec_args in (['-c:v', 'libx264', '-preset', 'veryfast'], ['-c:v', 'mpeg4']):
+        proc = _ffmpeg_popen(['-v', 'error', '-y', '-f', 'lavfi', '-i',
+                              'testsrc2=size=1920x1080:rate=30', '-t', str(duration),
+                              '-g', '30', '-pix_fmt', 'yuv420p'] + codec_args + [path],
+                             frozen)
+        err = proc.communicate()[1]
+        if not proc.returncode:
+            return
+    raise IOError(err.strip() or "couldn't generate the calibration video")
+
+
+def _measure(path, threads, thread_type, concurrency, frozen=False):
+    """Decode the video with concurrency ffmpegs at once
+
+    Returns:
+        Total decode time (sec)
+    """
+    start = time.time()
+    procs = [_ffmpeg_popen(['-v', 'error', '-nostats', '-threads', str(threads),
+                            '-thread_type', thread_type, '-i', path,
+                            '-f', 'null', '-'], frozen)
+             for x in range(concurrency)]
+    for proc in procs:
+        err = proc.communicate()[1]
+        if proc.returncode:
+            raise IOError(err.strip() or 'ffmpeg failed')
+    return time.time() - start
+
+
+def tune_threads(concurrency=1, num_cpus=None, frozen=False, duration=2.):
+    """Find the decoder threading with the most node throughput by decoding a
+    synthetic video with concurrency ffmpegs at once
+
+    Args:
+        concurrency: Number of videos decoded at once (e.g., pool_iter's
+            num_workers)
+        num_cpus: Number of cpus (default is all of them)
+        frozen: use the ffmpeg binary extracted from  ./ffmpegbin.tar
+        duration: Length (sec) of the calibration video, each setting takes
+            about as long as decoding it concurrency times
+
+    Returns:
+        Dict with keys
+        threads: Best number of decoder threads per ffmpeg
+        thread_type: Best threading, 'frame' or 'slice'
+        times: Dict of 'threads/thread_type' -> total decode time (sec)
+
+    Raises:
+        IOError: Problem running ffmpeg
+    """
+    assert concurrency > 0 and isinstance(concurrency, int)
+    if num_cpus is None:
+        num_cpus = multiprocessing.cpu_count()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'calibration.mp4')
+        _make_video(path, duration, frozen)
+        # Warm up the page cache, so the first setting isn't penalized
+        _measure(path, 1, 'frame', 1, frozen)
+        times = {}
+        for threads, thread_type in _candidates(num_cpus, concurrency):
+            times[(threads, thread_type)] = _measure(path, threads, thread_type,
+                                                     concurrency, frozen)
+    finally:
+        shutil.rmtree(tmpdir)
+    threads, thread_type = min(times, key=times.get)
+    return {'threads': threads, 'thread_type': thread_type,
+            'times': dict(('%d/%s' % k, v) for k, v in times.items())}
+
+
+def decoder_threads(concurrency=1, frozen=False, cache_path=CACHE_PATH):
+    """Tuned decoder threading for this node (see tune_threads)
+
+    The setting is tuned on first use and cached in cache_path (and in
+    memory), keyed by the ffmpeg version, number of cpus and concurrency.
+    After the first call it doesn't start any process.
+
+    Args:
+        concurrency: Number of videos decoded at once
+        frozen: use the ffmpeg binary extracted from  ./ffmpegbin.tar
+        cache_path: JSON cache file (None to only cache in memory)
+
+    Returns:
+        Tuple of threads, thread_type (see frame_iter)
+
+    Raises:
+        IOError: Problem running ffmpeg
+    """
+    num_cpus = multiprocessing.cpu_count()
+    key = '%s|%d cpus|%d at once' % (_ffmpeg_version(frozen), num_cpus, concurrency)
+    with _tuned_lock:
+        if (cache_path, key) in _tuned:
+            return _tuned[(cache_path, key)]
+        cache = {}
+        if cache_path is not None:
+            try:
+                with open(cache_path) as fp:
+                    cache = json.load(fp)
+            except (IOError, ValueError):
+                pass
+        if key not in cache:
+            tuned = tune_threads(concurrency, num_cpus, frozen)
+            cache[key] = [tuned['threads'], tuned['thread_type']]
+            if cache_path is not None:
+                # Renamed into place, readers never see a partial file
+                try:
+                    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_path)))
+                    with os.fdopen(fd, 'w') as fp:
+                        json.dump(cache, fp, indent=1)
+                    os.rename(tmp_path, cache_path)
+                except (IOError, OSError):
+                    pass
+        threads, thread_type = cache[key]
+        _tuned[(cache_path, key)] = int(threads), str(thread_type)
+        return _tuned[(cache_path, key)]